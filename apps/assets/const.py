@@ -15,3 +15,19 @@ class Protocol(Choice):
     ssh = 'ssh'
     mysql = 'mysql'
 
+
+class TaskStatus(Choice):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class TaskFrameType(Choice):
+    task_start = 'task_start'
+    command_start = 'command_start'
+    output = 'output'
+    command_end = 'command_end'
+    task_end = 'task_end'
+    target_end = 'target_end'
+    error = 'error'
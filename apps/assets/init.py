@@ -1,13 +1,36 @@
 # 这里的所有函数在项目启动的时候都会执行一次
 
 from assets.params import WorkerParamsNoPage
-from assets.models import Worker
-from libs.db import QuerySet
+from assets.models import Worker, WorkerScript
+from common.init import startup_step
+from common.utils import get_logger
 from libs.pools.worker import WorkerPool
 
 
+logger = get_logger()
+
+
+@startup_step(depends=())
+async def init_worker_script() -> None:
+    # 启动时计算一次脚本哈希，任务执行时不再读取本地脚本
+    script: WorkerScript = WorkerScript()
+    logger.info(f'Worker script version: {script.digest[:16]}')
+
+
+@startup_step(depends=('check_db', 'init_worker_script'))
 async def init_worker_pool() -> None:
     _params: WorkerParamsNoPage = WorkerParamsNoPage()
-    workers: list = await Worker.list(_params, return_model=True)
-    for worker in workers:
-        await WorkerPool().add_worker(worker)
+    pool: WorkerPool = WorkerPool()
+    count: int = 0
+    # 分批加载工作机，避免一次性把全部工作机读入内存
+    async for workers in Worker.iter_batches(_params):
+        for worker in workers:
+            await pool.add_worker(worker)
+        count += len(workers)
+        logger.debug(f'Loaded {count} workers into the worker pool')
+    logger.info(f'Worker pool initialized with {count} workers')
+
+
+@startup_step(depends=('init_worker_pool',))
+async def start_task_dispatcher() -> None:
+    await WorkerPool().start()
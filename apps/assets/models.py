@@ -1,23 +1,35 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
 import os
+import time
 import uuid
 
 import asyncssh
 import jwt
 
-from typing import Optional, Any
+from contextlib import asynccontextmanager
+from typing import Optional, Any, AsyncIterator, TYPE_CHECKING
 from gettext import gettext as _
 
 from pydantic import Field, BaseModel
 from fastapi.exceptions import ValidationException
-from asyncssh import SSHClientConnection, SSHCompletedProcess
+from asyncssh import SSHClientConnection, SSHCompletedProcess, SFTPClient, SFTPAttrs
 
-from assets.serializers import TaskInstance
 from settings import settings
 from common.models import RootModel
 from common.fields import EncryptedField
-from common.utils import get_logger, calc_file_md5, encrypt_json_file
+from common.utils import get_logger, singleton, calc_file_sha256, encrypt_json
+from libs.db import QuerySet
+from libs.pools.ssh import SSHConnectionPool
+from libs.pools.agent import AgentSession, AgentUnavailable
+
+from .const import PlatformCategory, Protocol, WorkerCategory, TaskFrameType
 
-from .const import PlatformCategory, Protocol, WorkerCategory
+if TYPE_CHECKING:
+    from assets.serializers import TaskInstance, BatchTaskInstance
 
 
 logger = get_logger()
@@ -79,9 +91,50 @@ class Task(RootModel):
         }
 
 
+class BatchTask(RootModel):
+    asset_ids: list[uuid.UUID] = Field(title=_('Assets'), json_schema_extra={'index': True})
+    fan_out: Optional[int] = Field(default=None, title=_('Fan-out'))
+    batch_size: Optional[int] = Field(default=None, title=_('Batch size'))
+
+    class Config(RootModel.Config):
+        table_name: str = 'assets_batch_task'
+
+
+class TaskOutput(RootModel):
+    task_id: uuid.UUID = Field(title=_('Task'))
+    seq: int = Field(title=_('Sequence'))
+    type: TaskFrameType = Field(title=_('Type'))
+    index: Optional[int] = Field(default=None, title=_('Command index'))
+    step: Optional[str] = Field(default=None, title=_('Step'))
+    status: Optional[str] = Field(default=None, title=_('Status'))
+    command: Optional[str] = Field(default=None, title=_('Command'))
+    stream: Optional[str] = Field(default=None, title=_('Stream'))
+    data: Optional[str] = Field(default=None, title=_('Data'))
+    asset_id: Optional[uuid.UUID] = Field(default=None, title=_('Asset'))
+    exit_code: Optional[int] = Field(default=None, title=_('Exit code'))
+    duration: Optional[float] = Field(default=None, title=_('Duration'))
+
+    class Config(RootModel.Config):
+        table_name: str = 'assets_task_output'
+        index_fields = RootModel.Config.index_fields + ('task_id',)
+
+
+@singleton
+class WorkerScript(object):
+    # 脚本内容在进程内只计算一次哈希，远端按哈希目录存放，内容变化即为新路径
+    def __init__(self) -> None:
+        self.local_file: str = os.path.join(
+            settings.APP_DIR, 'libs', 'script_templates', 'worker.py'
+        )
+        self.digest: str = calc_file_sha256(self.local_file)
+        self.remote_file: str = f'/tmp/behemoth/script/{self.digest[:16]}/worker.py'
+
+
 class Worker(Asset):
     platform: WorkerCategory = WorkerCategory.worker
     account: Optional[Account] = None
+    # 同时可执行的任务数，为空时使用配置中的默认值
+    slots: Optional[int] = Field(default=None, ge=1)
 
     class Config(Asset.Config):
         abstract: bool = True
@@ -91,16 +144,19 @@ class Worker(Asset):
 
     def __init__(self, **data: Any):
         super().__init__(**data)
-        self._ssh_client: Optional[SSHClientConnection] = None
-        self._local_script_file: str = os.path.join(
-            settings.APP_DIR, 'libs', 'script_templates', 'worker.py'
-        )
-        self._remote_script_file: str = '/tmp/behemoth/script/worker.py'
-        self._local_commands_file: Optional[str] = None
-        self._remote_commands_file: Optional[str] = None
+        self._script: WorkerScript = WorkerScript()
+        # 已确认部署到该工作机的脚本版本，命中时不再执行任何远端校验命令
+        self._deployed_scripts: set[str] = set()
+        self._deploy_lock: asyncio.Lock = asyncio.Lock()
+        self._staged_tasks: set[str] = set()
+        self._stage_lock: asyncio.Lock = asyncio.Lock()
+        # 常驻脚本进程，启动失败后在一段时间内回退为一次性执行
+        self._agent: Optional[AgentSession] = None
+        self._agent_lock: asyncio.Lock = asyncio.Lock()
+        self._agent_retry_at: float = 0
 
     async def set_account(self):
-        accounts = await Account.list(return_model=True)
+        accounts: QuerySet = await Account.query().filter(asset_id=str(self.id))[:1]
         if len(accounts) < 1:
             raise ValidationException({
                 'worker': _('%s has no account' % self)
@@ -114,99 +170,245 @@ class Worker(Asset):
                 port = p.port
         return port
 
-    async def test_connectivity(self, immediate_disconnect=True) -> bool:
-        connectivity: bool = False
-        try:
+    @asynccontextmanager
+    async def connect(self) -> AsyncIterator[SSHClientConnection]:
+        # 从连接池中取连接，同一工作机的任务共用连接，每个任务只新开 channel
+        if self.account is None:
             await self.set_account()
-        except Exception as error:
-            logger.error(f'Task worker set account failed: {error}')
-
+        async with SSHConnectionPool().connection(
+                self.address, await self.get_port(),
+                self.account.username, self.account.password
+        ) as conn:
+            yield conn
+
+    async def test_connectivity(self) -> bool:
+        # 探测需要与工作机真正往返一次，且有超时上限，避免卡住健康检查和任务派发
+        connectivity: bool = False
         try:
-            conn: SSHClientConnection = await asyncssh.connect(
-                    host=self.address, port=self.get_port(),
-                    username=self.account.username,
-                    password=self.account.password,
-                    known_hosts=None,
-            )
+            if self.account is None:
+                await self.set_account()
+            await asyncio.wait_for(SSHConnectionPool().probe(
+                self.address, await self.get_port(),
+                self.account.username, self.account.password
+            ), settings.WORKER.HEALTH_CHECK_TIMEOUT)
             connectivity = True
-            if not immediate_disconnect:
-                self._ssh_client = conn
-            else:
-                conn.close()
         except Exception as error:
-            logger.error(f'Task worker test ssh connect failed: {error}')
+            logger.error(f'Task worker test ssh connect failed: {error!r}')
         return connectivity
 
-    async def __check(self):
-        error: dict = {
-            'worker': _('The ssh client is not connected')
-        }
-        if self._ssh_client is None:
-            raise ValidationException(error)
-        session, __, __ = await self._ssh_client.open_session()
-        if session.is_closing():
-            raise ValidationException(error)
-
-    async def __ensure_script_exist(self) -> None:
-        result: SSHCompletedProcess = await self._ssh_client.run(
-            f'md5sum {self._remote_script_file}'
-        )
-        if result.returncode == 0:
-            remote_file_md5: str = str(result.stdout).split()[0].strip()
-            if calc_file_md5(self._local_script_file) == remote_file_md5:
-                return
+    async def __ensure_script_exist(self, sftp: SFTPClient) -> None:
+        script: WorkerScript = self._script
+        if script.digest in self._deployed_scripts:
+            return
 
-        await self._ssh_client.run(f'mkdir -p {os.path.dirname(self._remote_script_file)}')
-        await asyncssh.scp(
-            self._local_script_file, (self._ssh_client, self._remote_script_file)
-        )
+        async with self._deploy_lock:
+            if script.digest in self._deployed_scripts:
+                return
+            # 路径由内容哈希决定，文件存在即说明内容一致
+            if not await sftp.exists(script.remote_file):
+                # 先上传临时文件再重命名，避免并发任务读到不完整的脚本
+                temp_file: str = f'{script.remote_file}.{uuid.uuid4().hex}'
+                await sftp.makedirs(os.path.dirname(script.remote_file), exist_ok=True)
+                await sftp.put(script.local_file, temp_file)
+                await sftp.posix_rename(temp_file, script.remote_file)
+            self._deployed_scripts.add(script.digest)
 
-    async def __process_commands_file(self, task: TaskInstance):
-        commands_file_suffix: str = f'{task.id}.json'
-        local_commands_dir: str = os.path.join(settings.DATA_DIR, 'commands')
-        os.makedirs(local_commands_dir, exist_ok=True)
+    @staticmethod
+    def __get_remote_commands_file(task: TaskInstance | BatchTaskInstance) -> str:
+        return f'/tmp/behemoth/commands/{task.id}.json'
 
-        self._local_commands_file = os.path.join(local_commands_dir, commands_file_suffix)
-        self._remote_commands_file = f'/tmp/behemoth/commands/{commands_file_suffix}'
+    @staticmethod
+    async def __write_file(sftp: SFTPClient, path: str, content: bytes) -> None:
+        async with sftp.open(path, 'wb', SFTPAttrs(permissions=0o600)) as file:
+            await file.write(content)
 
+    @staticmethod
+    def __encrypt_commands(task: TaskInstance | BatchTaskInstance) -> bytes:
         # TODO commands模型还未创建，临时模拟点
-        data: dict = {'commands': ['echo hell', 'date', 'ls', 'pwd']}
-        encrypt_json_file(self._local_commands_file, data, task.encryption_key)
-
-        await self._ssh_client.run(f'mkdir -p {os.path.dirname(self._remote_commands_file)}')
-        await asyncssh.scp(
-            self._local_commands_file, (self._ssh_client, self._remote_commands_file)
-        )
-
-    async def __process_file(self, task: TaskInstance) -> None:
-        await self.__ensure_script_exist()
-        await self.__process_commands_file(task)
-        await asyncssh.scp(
-            self._src_path, (self._ssh_client, self._dest_path)
+        data: dict = {
+            'commands': ['echo hell', 'date', 'ls', 'pwd'],
+            'parallelism': settings.WORKER.SCRIPT_PARALLELISM,
+            'timeout': settings.WORKER.SCRIPT_COMMAND_TIMEOUT,
+            'max_output': settings.WORKER.SCRIPT_MAX_OUTPUT,
+        }
+        return encrypt_json(data, task.encryption_key)
+
+    async def __process_commands_file(
+            self, sftp: SFTPClient, task: TaskInstance | BatchTaskInstance
+    ) -> None:
+        remote_commands_file: str = self.__get_remote_commands_file(task)
+        # 加密后的内容直接从内存写入远端，不再落地本地临时文件
+        content: bytes = self.__encrypt_commands(task)
+        try:
+            await self.__write_file(sftp, remote_commands_file, content)
+        except asyncssh.SFTPNoSuchFile:
+            # 目录只在首次或被清理后才需要创建
+            await sftp.makedirs(os.path.dirname(remote_commands_file), exist_ok=True)
+            await self.__write_file(sftp, remote_commands_file, content)
+
+    async def __process_file(
+            self, sftp: SFTPClient, task: TaskInstance | BatchTaskInstance
+    ) -> None:
+        # 脚本与命令文件互不依赖，在同一个 SFTP 会话上并发发送请求
+        await asyncio.gather(
+            self.__ensure_script_exist(sftp),
+            self.__process_commands_file(sftp, task)
         )
 
-    async def __clear(self) -> None:
-        # 清理远端文件
-        result: SSHCompletedProcess = await self._ssh_client.run(f'rm -f {self._remote_commands_file}')
-        if result.returncode != 0:
-            logger.warning(f'Remote file({self._remote_commands_file}) deletion failed')
-        # 清理本地文件
-        os.remove(self._local_commands_file)
+    async def __clear(self, sftp: SFTPClient, task: TaskInstance | BatchTaskInstance) -> None:
+        remote_commands_file: str = self.__get_remote_commands_file(task)
+        try:
+            await sftp.remove(remote_commands_file)
+        except asyncssh.SFTPError as error:
+            logger.warning(f'Remote file({remote_commands_file}) deletion failed: {error}')
 
     @staticmethod
-    async def generate_token(task: TaskInstance) -> str:
-        payload: dict = {'type': 'task', 'id': task.id}
+    async def generate_token(task: TaskInstance | BatchTaskInstance) -> str:
+        payload: dict = {'type': 'task', 'id': str(task.id)}
         return jwt.encode(payload, settings.APP.SECRET_KEY, 'HS256')
 
-    async def __execute(self, task: TaskInstance) -> None:
-        await self.__process_file(task)
-        await self._ssh_client.create_process(
-            f'python3 -c {self._dest_file} -s {self.generate_token(task)} '
-            f'-w {str(task.worker.id)} -t {str(task.id)} -k {task.encryption_key}'
-        )
+    @staticmethod
+    def __parse_frame(line: str) -> dict:
+        # 脚本每行输出一个 JSON 帧，无法解析的内容按原始输出处理
+        try:
+            frame: Any = json.loads(line)
+            frame['type'] = TaskFrameType(frame['type'])
+        except (ValueError, TypeError, KeyError):
+            return {'type': TaskFrameType.output, 'stream': 'stdout', 'data': line}
+        return frame
+
+    async def __stage_once(self, sftp: SFTPClient, task: TaskInstance | BatchTaskInstance) -> None:
+        # 批量任务的命令文件在同一工作机上只上传一次，任务结束后统一清理
+        if str(task.id) in self._staged_tasks:
+            return
+        async with self._stage_lock:
+            if str(task.id) not in self._staged_tasks:
+                await self.__process_file(sftp, task)
+                self._staged_tasks.add(str(task.id))
+
+    async def __execute(
+            self, conn: SSHClientConnection, task: TaskInstance | BatchTaskInstance,
+            targets: Optional[list[dict]] = None
+    ) -> AsyncIterator[dict]:
+        remote_commands_file: str = self.__get_remote_commands_file(task)
+        command: str = f'python3 {self._script.remote_file} -c {remote_commands_file} ' \
+                       f'-s {await self.generate_token(task)} -w {str(self.id)} ' \
+                       f'-t {str(task.id)} -k {task.encryption_key}'
+        # 批量任务的目标资产通过标准输入传给脚本
+        stdin: Optional[str] = None
+        if targets is not None:
+            command, stdin = f'{command} -a', json.dumps(targets)
+        start: float = time.monotonic()
+        async with conn.create_process(command, input=stdin) as process:
+            # stderr 只保留末尾部分，用于脚本异常退出时排查
+            stderr: asyncio.Task = asyncio.create_task(process.stderr.read())
+            finished: bool = False
+            async for line in process.stdout:
+                if not (line := line.rstrip('\n')):
+                    continue
+                frame: dict = self.__parse_frame(line)
+                finished = finished or frame['type'] == TaskFrameType.task_end
+                yield frame
+            result: SSHCompletedProcess = await process.wait()
+            error: str = (await stderr)[-4096:]
+
+        if result.returncode != 0:
+            # 远端脚本可能已被清理(如主机重启清空 /tmp)，下次执行前重新校验
+            self._deployed_scripts.discard(self._script.digest)
+            logger.warning(f'{self} execute task {task.id} failed: {error}')
+            yield {'type': TaskFrameType.error, 'data': error}
+        if not finished:
+            yield {
+                'type': TaskFrameType.task_end, 'exit_code': result.returncode,
+                'duration': round(time.monotonic() - start, 3)
+            }
+
+    async def __prepare_agent(self, conn: SSHClientConnection) -> str:
+        await self.__ensure_script_exist(await SSHConnectionPool().sftp(conn))
+        return f'python3 {self._script.remote_file} --agent'
+
+    async def __get_agent(self) -> Optional[AgentSession]:
+        config = settings.WORKER
+        if not config.AGENT_MODE:
+            return None
+        if self._agent is not None and self._agent.alive:
+            return self._agent
+        if time.monotonic() < self._agent_retry_at:
+            return None
+
+        async with self._agent_lock:
+            if self._agent is not None and self._agent.alive:
+                return self._agent
+            if time.monotonic() < self._agent_retry_at:
+                return None
+            agent: AgentSession = AgentSession(self.name, config.AGENT_IDLE_TIMEOUT)
+            try:
+                await agent.start(self.connect, self.__prepare_agent)
+            except Exception as error:
+                # 旧版本脚本、远端无法常驻等情况下回退为一次性执行
+                self._agent_retry_at = time.monotonic() + config.AGENT_RETRY_INTERVAL
+                logger.warning(f'{self} failed to start agent, fall back to one-shot mode: {error}')
+                return None
+            logger.debug(f'{self} agent started')
+            self._agent = agent
+        return agent
+
+    async def __run_on_agent(
+            self, agent: AgentSession, task: TaskInstance | BatchTaskInstance,
+            targets: Optional[list[dict]] = None
+    ) -> AsyncIterator[dict]:
+        # 命令集随信封一起加密发送，不再上传命令文件
+        envelope: dict = {
+            'credential': await self.generate_token(task),
+            'worker_id': str(self.id), 'task_id': str(task.id),
+            'encryption_key': task.encryption_key,
+            'commands': base64.b64encode(self.__encrypt_commands(task)).decode(),
+        }
+        if targets is not None:
+            envelope['targets'] = targets
+        async for frame in agent.run(envelope):
+            yield frame
+
+    async def close_agent(self) -> None:
+        agent, self._agent = self._agent, None
+        if agent is not None:
+            await agent.close()
+
+    async def stream(
+            self, task: TaskInstance | BatchTaskInstance,
+            targets: Optional[list[dict]] = None
+    ) -> AsyncIterator[dict]:
+        # 逐帧返回执行过程，调用方边读边处理，不在内存中缓存完整输出
+        if (agent := await self.__get_agent()) is not None:
+            started: bool = False
+            try:
+                async for frame in self.__run_on_agent(agent, task, targets):
+                    started = True
+                    yield frame
+                return
+            except AgentUnavailable:
+                # 信封尚未发出时常驻进程已退出，本次改用一次性执行
+                if started:
+                    raise
+
+        async with self.connect() as conn:
+            sftp: SFTPClient = await SSHConnectionPool().sftp(conn)
+            if targets is not None:
+                await self.__stage_once(sftp, task)
+                async for frame in self.__execute(conn, task, targets):
+                    yield frame
+                return
 
-    async def run(self, task: TaskInstance) -> None:
-        # TODO 这里参数得传入Task对象，根据Task对象生成commands文件名称
-        await self.__check()
-        await self.__execute(task)
-        await self.__clear()
+            try:
+                await self.__process_file(sftp, task)
+                async for frame in self.__execute(conn, task):
+                    yield frame
+            finally:
+                await self.__clear(sftp, task)
+
+    async def clear(self, task: BatchTaskInstance) -> None:
+        if str(task.id) not in self._staged_tasks:
+            return
+        self._staged_tasks.discard(str(task.id))
+        async with self.connect() as conn:
+            await self.__clear(await SSHConnectionPool().sftp(conn), task)
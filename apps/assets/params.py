@@ -1,3 +1,8 @@
+from datetime import datetime
+from gettext import gettext as _
+from typing import Optional
+
+from fastapi import Query
 from pydantic import BaseModel
 
 from common.query import RootParams
@@ -5,6 +10,12 @@ from assets.const import WorkerCategory
 
 
 class AssetParams(RootParams):
+    name__match: Optional[str] = Query(None, description=_('Name contains'))
+    tag__prefix: Optional[str] = Query(None, description=_('Tag prefix'))
+    update_time__gte: Optional[datetime] = Query(None, description=_('Updated since'))
+
+
+class WorkerParams(AssetParams):
     pass
 
 
@@ -13,4 +24,5 @@ class WorkerParamsNoPage(BaseModel):
 
 
 class AccountParams(RootParams):
-    pass
+    username: Optional[str] = Query(None, description=_('Username'))
+    asset_id: Optional[str] = Query(None, description=_('Asset'))
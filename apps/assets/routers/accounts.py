@@ -1,10 +1,13 @@
+import uuid
+
 from gettext import gettext as _
 
-from fastapi import APIRouter, Depends
-from fastapi_pagination import Page, paginate
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 
-from libs.db import QuerySet
+from common.serializers import BulkResult
+from common.query import CursorPage
+from libs.db import QuerySet, Query
 from .. import models, serializers, params
 
 
@@ -13,11 +16,14 @@ router = APIRouter(tags=[_('Account')])
 
 @router.get(
     '/accounts/', summary=_('List accounts'),
-    response_model=Page[models.Account]
+    response_model=CursorPage[models.Account]
 )
 async def list_accounts(p: params.AccountParams = Depends()) -> list[dict]:
-    qs: QuerySet = await models.Account.list(p)
-    return paginate(qs.data(), p, length_function=lambda x: len(qs))
+    # 列表中不返回密码，也就不需要从 ES 读取
+    fields: list[str] = [f for f in models.Account.model_fields if f != 'password']
+    query: Query = Query(models.Account).only(*fields)
+    qs: QuerySet = await models.Account.list(p, query=query)
+    return CursorPage.create(qs.data, p, total=len(qs), next_cursor=qs.next_cursor)
 
 
 @router.post(
@@ -29,18 +35,38 @@ async def create_account(instance: serializers.Account) -> BaseModel:
     return instance
 
 
+@router.post(
+    '/accounts/bulk/', summary=_('Bulk create accounts'),
+    response_model=list[BulkResult],
+)
+async def bulk_create_accounts(instances: list[serializers.Account]) -> list[dict]:
+    return await models.Account.bulk_save([i.to_model() for i in instances])
+
+
+async def get_account_or_404(account_id: uuid.UUID) -> models.Account:
+    instance: models.Account = await models.Account.get(account_id)
+    if instance is None:
+        raise HTTPException(status_code=404, detail=_('Account not found'))
+    return instance
+
+
 @router.get(
-    '/accounts/{account_id}/', summary=_('Get account')
+    '/accounts/{account_id}/', summary=_('Get account'),
+    response_model=models.Account, response_model_exclude={'password'}
 )
-async def get_account() -> dict:
-    pass
+async def get_account(
+        instance: models.Account = Depends(get_account_or_404)
+) -> BaseModel:
+    return instance
 
 
 @router.delete(
     '/accounts/{account_id}/', summary=_('Delete account')
 )
-async def delete_account() -> None:
-    pass
+async def delete_account(
+        instance: models.Account = Depends(get_account_or_404)
+) -> None:
+    await instance.delete()
 
 
 @router.put(
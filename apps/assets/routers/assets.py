@@ -3,8 +3,9 @@ from typing import Any
 
 from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
-from fastapi_pagination import Page, create_page
 
+from common.serializers import BulkResult
+from common.query import CursorPage
 from libs.db import QuerySet
 from .. import models, serializers, params
 
@@ -14,11 +15,11 @@ router = APIRouter(tags=[_('Asset')])
 
 @router.get(
     '/assets/', summary=_('List assets'),
-    response_model=Page[models.Asset]
+    response_model=CursorPage[models.Asset]
 )
 async def list_assets(request: Request, p: params.AssetParams = Depends()) -> Any:
     qs: QuerySet = await models.Asset.list(p)
-    return create_page(qs.data, len(qs), p)
+    return CursorPage.create(qs.data, p, total=len(qs), next_cursor=qs.next_cursor)
 
 
 @router.post(
@@ -28,3 +29,11 @@ async def list_assets(request: Request, p: params.AssetParams = Depends()) -> An
 async def create_asset(instance: serializers.Asset) -> BaseModel:
     instance: BaseModel = await instance.save()
     return instance
+
+
+@router.post(
+    '/assets/bulk/', summary=_('Bulk create assets'),
+    response_model=list[BulkResult],
+)
+async def bulk_create_assets(instances: list[serializers.Asset]) -> list[dict]:
+    return await models.Asset.bulk_save([i.to_model() for i in instances])
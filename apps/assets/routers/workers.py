@@ -1,13 +1,20 @@
+import json
+import uuid
+
 from gettext import gettext as _
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from fastapi_pagination import Page, create_page
 
-from assets.const import WorkerCategory
+from settings import settings
+from assets.const import WorkerCategory, TaskStatus
 from common.utils import random_string
+from common.query import CursorPage
 from libs.db import QuerySet
+from libs.pools.output import TaskOutputHub
 from libs.pools.worker import WorkerPool
 from .. import models, serializers, params
 
@@ -27,25 +34,101 @@ async def create_worker(instance: serializers.Worker) -> BaseModel:
 
 @router.get(
     '/workers/', summary=_('List workers'),
-    response_model=Page[models.Worker]
+    response_model=CursorPage[models.Worker]
 )
-async def list_workers(p: params.AssetParams = Depends()) -> Any:
+async def list_workers(p: params.WorkerParams = Depends()) -> Any:
     qs: QuerySet = await models.Worker.list(
         p, extra_query={'platform': WorkerCategory.worker}
     )
-    return create_page(qs.data, len(qs), p)
+    return CursorPage.create(qs.data, p, total=len(qs), next_cursor=qs.next_cursor)
 
 
 @router.post(
     '/workers/tasks/', summary=_('Create worker task'),
-    response_model=models.Worker,
+    response_model=serializers.TaskState,
 )
-async def create_worker_task(instance: serializers.Task) -> BaseModel:
-    instance: BaseModel = await instance.save()
-    # TODO 这里观察下 instance返回的资产中是id还是一个对象，如果是对象就可以节省一次查询
+async def create_worker_task(task: serializers.Task) -> BaseModel:
+    asset: Optional[BaseModel] = await models.Asset.get(task.asset_id)
+    if asset is None:
+        raise HTTPException(status_code=404, detail=_('Asset not found'))
+    instance: BaseModel = await task.save()
     task_instance = serializers.TaskInstance(
-        id=instance.id, asset=models.Asset.list(extra_query={'asset_id': instance.asset_id}),
+        id=instance.id, asset=asset,
         encryption_key=random_string(length=32, upper=False),
+        priority=task.priority,
     )
-    await WorkerPool().work(task_instance)
-    return instance
+    # 任务进入队列后立即返回，执行进度通过任务状态接口查询
+    return await WorkerPool().submit(task_instance)
+
+
+@router.get(
+    '/workers/tasks/{task_id}/', summary=_('Get worker task state'),
+    response_model=serializers.TaskState,
+)
+async def get_worker_task(task_id: uuid.UUID) -> BaseModel:
+    state: Optional[BaseModel] = await WorkerPool().get_state(str(task_id))
+    if state is None:
+        raise HTTPException(status_code=404, detail=_('Task not found'))
+    return state
+
+
+@router.post(
+    '/workers/batch-tasks/', summary=_('Create worker batch task'),
+    response_model=serializers.BatchTaskState,
+)
+async def create_worker_batch_task(task: serializers.BatchTask) -> BaseModel:
+    instance: BaseModel = await task.save()
+    task_instance = serializers.BatchTaskInstance(
+        id=instance.id, asset_ids=instance.asset_ids,
+        encryption_key=random_string(length=32, upper=False),
+        fan_out=task.fan_out or settings.WORKER.BATCH_FAN_OUT,
+        batch_size=task.batch_size or settings.WORKER.BATCH_SIZE,
+    )
+    # 同一命令集在多个资产上执行，按工作机分组后只上传一次命令文件
+    return await WorkerPool().submit_batch(task_instance)
+
+
+@router.get(
+    '/workers/batch-tasks/{task_id}/', summary=_('Get worker batch task progress'),
+    response_model=serializers.BatchTaskState,
+)
+async def get_worker_batch_task(task_id: uuid.UUID) -> BaseModel:
+    state: Optional[BaseModel] = await WorkerPool().get_batch_state(str(task_id))
+    if state is None:
+        raise HTTPException(status_code=404, detail=_('Task not found'))
+    return state
+
+
+@router.get(
+    '/workers/batch-tasks/{task_id}/results/', summary=_('List worker batch task results'),
+    response_model=list[serializers.BatchAssetResult],
+)
+async def list_worker_batch_task_results(
+        task_id: uuid.UUID, status: Optional[TaskStatus] = None
+) -> Any:
+    results: Optional[list] = await WorkerPool().get_batch_results(str(task_id), status)
+    if results is None:
+        raise HTTPException(status_code=404, detail=_('Task not found'))
+    return results
+
+
+@router.get(
+    '/workers/tasks/{task_id}/output/', summary=_('Stream worker task output'),
+    response_class=StreamingResponse,
+)
+async def stream_worker_task_output(
+        task_id: uuid.UUID, last_event_id: Optional[int] = Header(default=None)
+) -> StreamingResponse:
+    if await models.Task.get(task_id) is None and await models.BatchTask.get(task_id) is None:
+        raise HTTPException(status_code=404, detail=_('Task not found'))
+
+    async def events() -> AsyncIterator[str]:
+        # SSE 格式推送，断线重连时客户端带上 Last-Event-ID 从断点继续
+        after: int = -1 if last_event_id is None else last_event_id
+        async for output in TaskOutputHub().follow(str(task_id), after):
+            data: str = json.dumps(jsonable_encoder(output.model_dump(
+                exclude={'id', 'task_id', 'create_time', 'update_time', 'comment'}
+            )))
+            yield f'id: {output.seq}\nevent: {output.type.value}\ndata: {data}\n\n'
+
+    return StreamingResponse(events(), media_type='text/event-stream')
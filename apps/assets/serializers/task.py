@@ -1,10 +1,12 @@
 import uuid
 
+from datetime import datetime
 from gettext import gettext as _
 from typing import Optional
 
-from pydantic import Field
+from pydantic import BaseModel, Field
 
+from assets.const import TaskStatus
 from common.serializers import RootModelSerializer
 from .. import models
 
@@ -12,6 +14,7 @@ from .. import models
 class Task(RootModelSerializer):
     asset_id: uuid.UUID = Field(title=_('Asset'))
     worker_id: uuid.UUID = Field(title=_('Worker'))
+    priority: int = Field(default=0, title=_('Priority'))
 
     class Config:
         model = models.Task
@@ -21,3 +24,54 @@ class TaskInstance(RootModelSerializer):
     asset: models.Asset
     worker: Optional[models.Worker] = None
     encryption_key: str
+    priority: int = 0
+
+
+class TaskState(BaseModel):
+    id: uuid.UUID = Field(title=_('ID'))
+    status: TaskStatus = Field(default=TaskStatus.queued, title=_('Status'))
+    priority: int = Field(default=0, title=_('Priority'))
+    worker_id: Optional[uuid.UUID] = Field(default=None, title=_('Worker'))
+    error: Optional[str] = Field(default=None, title=_('Error'))
+    queued_at: datetime = Field(default_factory=datetime.now, title=_('Queued time'))
+    started_at: Optional[datetime] = Field(default=None, title=_('Started time'))
+    finished_at: Optional[datetime] = Field(default=None, title=_('Finished time'))
+
+
+class BatchTask(RootModelSerializer):
+    asset_ids: list[uuid.UUID] = Field(min_length=1, title=_('Assets'))
+    fan_out: Optional[int] = Field(default=None, ge=1, title=_('Fan-out'))
+    batch_size: Optional[int] = Field(default=None, ge=1, title=_('Batch size'))
+
+    class Config:
+        model = models.BatchTask
+
+
+class BatchTaskInstance(RootModelSerializer):
+    asset_ids: list[uuid.UUID]
+    encryption_key: str
+    fan_out: int
+    batch_size: int
+
+
+class BatchAssetResult(BaseModel):
+    asset_id: uuid.UUID = Field(title=_('Asset'))
+    status: TaskStatus = Field(default=TaskStatus.queued, title=_('Status'))
+    worker_id: Optional[uuid.UUID] = Field(default=None, title=_('Worker'))
+    exit_code: Optional[int] = Field(default=None, title=_('Exit code'))
+    duration: Optional[float] = Field(default=None, title=_('Duration'))
+    error: Optional[str] = Field(default=None, title=_('Error'))
+
+
+class BatchTaskState(BaseModel):
+    id: uuid.UUID = Field(title=_('ID'))
+    status: TaskStatus = Field(default=TaskStatus.queued, title=_('Status'))
+    total: int = Field(default=0, title=_('Total'))
+    queued: int = Field(default=0, title=_('Queued'))
+    running: int = Field(default=0, title=_('Running'))
+    done: int = Field(default=0, title=_('Done'))
+    failed: int = Field(default=0, title=_('Failed'))
+    error: Optional[str] = Field(default=None, title=_('Error'))
+    queued_at: datetime = Field(default_factory=datetime.now, title=_('Queued time'))
+    started_at: Optional[datetime] = Field(default=None, title=_('Started time'))
+    finished_at: Optional[datetime] = Field(default=None, title=_('Finished time'))
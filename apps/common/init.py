@@ -1,17 +1,105 @@
+import asyncio
 import importlib
 import inspect
+import time
+
+from typing import Callable, Optional
 
 from common.models import RootModel
+from common.utils import get_logger
+from settings import settings
 from libs.jms.client import jms_client
 
 
+logger = get_logger()
+
+STARTUP_APPS: tuple = ('assets',)
+
+
+def startup_step(name: Optional[str] = None, depends: tuple = ('check_db',)) -> Callable:
+    # 声明应用初始化函数的步骤名称及依赖，未声明时默认依赖数据库检查完成
+    def decorator(func: Callable) -> Callable:
+        func.startup_name = name or func.__name__
+        func.startup_depends = depends
+        return func
+
+    return decorator
+
+
+class StartupOrchestrator(object):
+    def __init__(self) -> None:
+        self._steps: dict[str, tuple[Callable, tuple]] = {}
+        self._profile: dict[str, float] = {}
+
+    def add(self, name: str, func: Callable, depends: tuple = ()) -> None:
+        if name in self._steps:
+            raise ValueError(f'Startup step {name} already exists')
+        self._steps[name] = (func, tuple(depends))
+
+    def _validate(self) -> None:
+        visiting, visited = set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Startup step {name} has a circular dependency')
+            visiting.add(name)
+            for dependency in self._steps[name][1]:
+                if dependency not in self._steps:
+                    raise ValueError(
+                        f'Startup step {name} depends on unknown step {dependency}'
+                    )
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for step_name in self._steps:
+            visit(step_name)
+
+    async def _run_step(self, name: str, tasks: dict[str, asyncio.Task]) -> None:
+        func, depends = self._steps[name]
+        await asyncio.gather(*[tasks[d] for d in depends])
+        start: float = time.perf_counter()
+        await func()
+        self._profile[name] = time.perf_counter() - start
+        logger.debug(f'Startup step {name} finished in {self._profile[name]:.3f}s')
+
+    async def run(self) -> None:
+        self._validate()
+        start: float = time.perf_counter()
+        # 没有依赖关系的步骤并发执行，任意步骤失败时取消其余步骤
+        async with asyncio.TaskGroup() as group:
+            tasks: dict[str, asyncio.Task] = {}
+            for name in self._steps:
+                tasks[name] = group.create_task(self._run_step(name, tasks))
+
+        total: float = time.perf_counter() - start
+        profile: str = ', '.join(
+            f'{name}={cost:.3f}s' for name, cost in
+            sorted(self._profile.items(), key=lambda x: x[1], reverse=True)
+        )
+        logger.info(f'Startup finished in {total:.3f}s: {profile}')
+
+
 async def check_jms():
-    pass
+    # 加载或注册 access key，状态上报等访问 Core 的功能都依赖它
+    await jms_client.check()
+    if jms_client.access_key is not None:
+        return
+    if settings.APP.CORE_REPORT_ENABLED:
+        raise RuntimeError('JumpServer client is not registered, task status cannot be reported')
+    logger.error('JumpServer client is not registered, requests to core will fail')
 
 
 async def check_db():
-    db_check_apps = ['assets']
-    for app_name in db_check_apps:
+    # 所有模型检查完成的汇合点，供其他步骤声明依赖
+    pass
+
+
+def get_check_models() -> list[RootModel]:
+    models: dict[str, RootModel] = {}
+    for app_name in STARTUP_APPS:
         try:
             module = importlib.import_module(f'apps.{app_name}.models')
         except ModuleNotFoundError:
@@ -20,13 +108,15 @@ async def check_db():
         for name, obj in inspect.getmembers(module):
             if inspect.isclass(obj) and inspect.getmodule(obj) == module \
                     and issubclass(obj, RootModel) and hasattr(obj, 'check'):
-                if getattr(getattr(obj, 'Config', None), 'abstract', False):
-                    await obj.check()
+                # abstract 模型复用其他模型的索引，不单独检查
+                if not getattr(getattr(obj, 'Config', None), 'abstract', False):
+                    models.setdefault(obj.model_config.get('table_name'), obj)
+    return list(models.values())
 
 
-async def apps_init():
-    db_check_apps = ['assets']
-    for app_name in db_check_apps:
+def get_init_functions() -> list[Callable]:
+    functions: list = []
+    for app_name in STARTUP_APPS:
         try:
             module = importlib.import_module(f'apps.{app_name}.init')
         except ModuleNotFoundError:
@@ -34,4 +124,24 @@ async def apps_init():
 
         for name, obj in inspect.getmembers(module):
             if inspect.isfunction(obj) and inspect.getmodule(obj) == module:
-                await obj()
+                functions.append(obj)
+    return functions
+
+
+async def startup() -> None:
+    orchestrator: StartupOrchestrator = StartupOrchestrator()
+    orchestrator.add('check_jms', check_jms)
+
+    db_steps: list[str] = []
+    for model in get_check_models():
+        step_name: str = f'check_db:{model.model_config.get("table_name")}'
+        orchestrator.add(step_name, model.check)
+        db_steps.append(step_name)
+    orchestrator.add('check_db', check_db, depends=tuple(db_steps))
+
+    for func in get_init_functions():
+        orchestrator.add(
+            getattr(func, 'startup_name', func.__name__), func,
+            depends=getattr(func, 'startup_depends', ('check_db',))
+        )
+    await orchestrator.run()
@@ -2,13 +2,13 @@ from __future__ import annotations
 
 import uuid
 
-from typing import Optional
+from typing import AsyncIterator, Optional
 from gettext import gettext as _
 from datetime import datetime
 
 from pydantic import BaseModel, Field
 
-from libs.db import DBManager, QuerySet
+from libs.db import DBManager, QuerySet, Query
 
 
 class RootModel(BaseModel, DBManager):
@@ -30,6 +30,11 @@ class RootModel(BaseModel, DBManager):
         index_fields: tuple = tuple()
         abstract: bool = False
 
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs) -> None:
+        super().__pydantic_init_subclass__(**kwargs)
+        cls._compile_schema()
+
     def _get_exclude_fields(self, instance: Optional['RootModel'] = None) -> set:
         exclude = set()
         for name, field in self.model_fields.items():
@@ -46,18 +51,64 @@ class RootModel(BaseModel, DBManager):
         await self._save(data=self.model_dump(exclude=exclude_fields))
         return self
 
+    @classmethod
+    async def get(cls: 'RootModel', _id: uuid.UUID | str) -> Optional['RootModel']:
+        data: Optional[dict] = await cls._get(str(_id))
+        return None if data is None else cls(**data) # noqa
+
+    @classmethod
+    async def get_many(cls: 'RootModel', ids: list[uuid.UUID | str]) -> list['RootModel']:
+        result: list[dict] = await cls._get_many([str(i) for i in ids])
+        return [cls(**d) for d in result] # noqa
+
+    async def delete(self) -> None:
+        await self._delete([str(self.id)])
+
+    @classmethod
+    async def bulk_save(
+            cls: 'RootModel', instances: list['RootModel'],
+            chunk_size: Optional[int] = None, refresh: Optional[str] = None
+    ) -> list[dict]:
+        documents: list[dict] = [
+            i.model_dump(exclude=i._get_exclude_fields()) for i in instances
+        ]
+        return await cls._bulk_save(documents, chunk_size=chunk_size, refresh=refresh)
+
+    @classmethod
+    def query(cls: 'RootModel') -> QuerySet:
+        return QuerySet(cls)
+
     @classmethod
     async def list(
             cls: 'RootModel', p: Optional[BaseModel] = None,
-            extra_query: Optional[dict] = None, return_model: bool = False
+            extra_query: Optional[dict] = None, return_model: bool = False,
+            query: Optional[Query] = None
     ) -> QuerySet | list:
-        query = {} if p is None else p.model_dump(mode='json')
+        params = {} if p is None else p.model_dump(mode='json')
         if extra_query:
-            query.update(extra_query)
-        result: dict = await cls._list(query)
+            params.update(extra_query)
+        queryset: QuerySet = await QuerySet(cls, query, params)
         if return_model:
-            return [cls(**d) for d in result['data']] # noqa
-
-        queryset: QuerySet = QuerySet(result, model=cls)
+            return list(queryset)
         return queryset
 
+    @classmethod
+    async def iter_batches(
+            cls: 'RootModel', p: Optional[BaseModel] = None,
+            extra_query: Optional[dict] = None, batch_size: Optional[int] = None,
+            query: Optional[Query] = None
+    ) -> AsyncIterator[list['RootModel']]:
+        params = {} if p is None else p.model_dump(mode='json')
+        if extra_query:
+            params.update(extra_query)
+        async for batch in cls._iter_batches(params, batch_size, query):
+            yield [cls(**d) for d in batch] # noqa
+
+    @classmethod
+    async def iter_all(
+            cls: 'RootModel', p: Optional[BaseModel] = None,
+            extra_query: Optional[dict] = None, batch_size: Optional[int] = None
+    ) -> AsyncIterator['RootModel']:
+        async for batch in cls.iter_batches(p, extra_query, batch_size):
+            for instance in batch:
+                yield instance
@@ -1,9 +1,26 @@
 from gettext import gettext as _
+from typing import Generic, Optional, TypeVar
 
 from fastapi import Query
-from fastapi_pagination.default import Params
+from fastapi_pagination.default import Params, Page
+
+
+T = TypeVar('T')
 
 
 class RootParams(Params):
     page: int = Query(1, description=_('Page number'))
     size: int = Query(15, ge=1, le=100, description=_('Page size'))
+    cursor: Optional[str] = Query(
+        None, description=_(
+            'Cursor pagination, pass an empty value to start and then the '
+            'next_cursor of the previous page, page is ignored'
+        )
+    )
+    ordering: Optional[str] = Query(
+        None, description=_('Sort fields separated by commas, prefix - for descending')
+    )
+
+
+class CursorPage(Page[T], Generic[T]):
+    next_cursor: Optional[str] = None
@@ -10,6 +10,15 @@ class RootModelSerializer(BaseModel):
         default_factory=lambda: uuid.uuid4(), title=_('ID'),
     )
 
+    def to_model(self) -> BaseModel:
+        return self.Config.model(**self.model_dump())
+
     async def save(self) -> BaseModel:
-        instance: BaseModel = self.Config.model(**self.model_dump())
+        instance: BaseModel = self.to_model()
         return await instance.save()
+
+
+class BulkResult(BaseModel):
+    id: uuid.UUID = Field(title=_('ID'))
+    success: bool = Field(title=_('Success'))
+    errors: dict = Field(default_factory=dict, title=_('Errors'))
@@ -0,0 +1,31 @@
+import asyncio
+import json
+
+from common.utils import get_logger
+from settings import settings
+from libs.db import ESClient
+from libs.db.cache import ESCache
+from libs.pools import SSHConnectionPool
+from libs.pools.worker import WorkerPool
+
+
+logger = get_logger()
+
+
+def collect_stats() -> dict:
+    return {
+        'es_nodes': ESClient().stats(),
+        'es_cache': ESCache().stats(),
+        'ssh_connections': SSHConnectionPool().stats(),
+        'workers': WorkerPool().stats(),
+    }
+
+
+async def log_stats() -> None:
+    # 定期输出各连接池与工作机的运行状态，便于排查性能问题
+    while True:
+        await asyncio.sleep(settings.APP.STATS_LOG_INTERVAL)
+        try:
+            logger.info(f'Runtime stats: {json.dumps(collect_stats(), default=str)}')
+        except Exception as error:
+            logger.error(f'Collect runtime stats failed: {error}')
@@ -1,6 +1,6 @@
 import os
 import hashlib
-import random
+import secrets
 import string
 import json
 
@@ -64,7 +64,7 @@ def random_string(
         letters += string.ascii_lowercase
     if upper:
         letters += string.ascii_uppercase
-    return ''.join(random.sample(letters, length))
+    return ''.join(secrets.choice(letters) for __ in range(length))
 
 
 def calc_file_md5(file_path):
@@ -75,6 +75,14 @@ def calc_file_md5(file_path):
     return md5_hash.hexdigest()
 
 
+def calc_file_sha256(file_path):
+    with open(file_path, 'rb') as file:
+        sha256_hash = hashlib.sha256()
+        while chunk := file.read(4096):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
 # 加密函数
 def encrypt(plaintext, key):
     cipher = AES.new(key, AES.MODE_CBC)
@@ -89,8 +97,12 @@ def decrypt(ciphertext, key):
     return plaintext.decode()
 
 
+def encrypt_json(content: Any, secret: str) -> bytes:
+    return encrypt(json.dumps(content), secret.encode())
+
+
 def encrypt_json_file(file_path: str, content: Any, secret: str) -> None:
-    encrypted_data: Any = encrypt(json.dumps(content), secret)
+    encrypted_data: bytes = encrypt_json(content, secret)
 
     with open(file_path, 'wb') as encrypted_file:
         encrypted_file.write(encrypted_data)
@@ -100,6 +112,6 @@ def decrypt_json_file(file_path: str, secret: str) -> None:
     with open(file_path, 'rb') as encrypted_file:
         encrypted_data = encrypted_file.read()
 
-    decrypted_data = decrypt(encrypted_data, secret)
+    decrypted_data = decrypt(encrypted_data, secret.encode())
     data = json.loads(decrypted_data)
     return data
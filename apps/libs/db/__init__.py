@@ -1,5 +1,8 @@
+from .client import ESClient
 from .es import ESManager, ESQuerySet
+from .query import ESQuery
 
 
 DBManager = ESManager
 QuerySet = ESQuerySet
+Query = ESQuery
@@ -0,0 +1,119 @@
+import json
+import time
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional
+
+from settings import settings
+from common.utils import singleton
+
+
+class CacheBackend(ABC):
+    # 共享缓存(如 Redis)实现这三个方法即可替换默认的进程内缓存
+    @abstractmethod
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, value: Any, ttl: int) -> None:
+        ...
+
+    @abstractmethod
+    async def invalidate(self, namespace: str) -> None:
+        ...
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_size: int) -> None:
+        self._max_size: int = max_size
+        self._items: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._namespaces: dict[str, set] = {}
+
+    def _remove(self, item_key: tuple) -> None:
+        self._items.pop(item_key, None)
+        if keys := self._namespaces.get(item_key[0]):
+            keys.discard(item_key)
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        item_key: tuple = (namespace, key)
+        if not (item := self._items.get(item_key)):
+            return None
+
+        expire_time, value = item
+        if expire_time < time.monotonic():
+            self._remove(item_key)
+            return None
+        self._items.move_to_end(item_key)
+        return value
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: int) -> None:
+        item_key: tuple = (namespace, key)
+        self._items[item_key] = (time.monotonic() + ttl, value)
+        self._items.move_to_end(item_key)
+        self._namespaces.setdefault(namespace, set()).add(item_key)
+        while len(self._items) > self._max_size:
+            oldest_key, __ = next(iter(self._items.items()))
+            self._remove(oldest_key)
+
+    async def invalidate(self, namespace: str) -> None:
+        for item_key in self._namespaces.pop(namespace, set()):
+            self._items.pop(item_key, None)
+
+
+@singleton
+class ESCache(object):
+    def __init__(self) -> None:
+        self._enabled: bool = settings.ES.CACHE_ENABLED
+        self._ttl: int = settings.ES.CACHE_TTL
+        self._backend: CacheBackend = MemoryCacheBackend(settings.ES.CACHE_MAX_SIZE)
+        self._hits: int = 0
+        self._misses: int = 0
+        # 每次写入使索引的版本号加一，查询开始后发生过写入的结果不再缓存
+        self._generations: dict[str, int] = {}
+        # 未 refresh 的写入在该时间点之前对查询不可见，期间的查询结果不缓存
+        self._settle_until: dict[str, float] = {}
+
+    def set_backend(self, backend: CacheBackend) -> None:
+        self._backend = backend
+
+    @staticmethod
+    def _make_key(body: dict) -> str:
+        return json.dumps(body, sort_keys=True, default=str)
+
+    async def get(self, index_name: str, body: dict) -> Optional[Any]:
+        if not self._enabled:
+            return None
+
+        value: Optional[Any] = await self._backend.get(index_name, self._make_key(body))
+        if value is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return value
+
+    def generation(self, index_name: str) -> int:
+        return self._generations.get(index_name, 0)
+
+    async def set(self, index_name: str, body: dict, value: Any, generation: int) -> None:
+        if not self._enabled or generation != self.generation(index_name):
+            return
+        if time.monotonic() < self._settle_until.get(index_name, 0):
+            return
+        await self._backend.set(index_name, self._make_key(body), value, self._ttl)
+
+    async def invalidate(self, index_name: str, refreshed: bool = False) -> None:
+        if not self._enabled:
+            return
+        self._generations[index_name] = self.generation(index_name) + 1
+        if not refreshed:
+            self._settle_until[index_name] = \
+                time.monotonic() + settings.ES.INDEX_REFRESH_INTERVAL
+        await self._backend.invalidate(index_name)
+
+    def stats(self) -> dict:
+        total: int = self._hits + self._misses
+        return {
+            'hits': self._hits, 'misses': self._misses,
+            'hit_rate': self._hits / total if total else 0.0
+        }
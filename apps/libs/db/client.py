@@ -0,0 +1,107 @@
+import time
+
+from gettext import gettext as _
+from typing import Any, Optional
+
+from elasticsearch import AsyncElasticsearch
+from elastic_transport import AiohttpHttpNode
+
+from settings import settings
+from common.utils import singleton, get_logger
+
+
+logger = get_logger()
+
+
+class NodeStats(object):
+    # 延迟使用 EWMA 平滑，避免单次慢请求影响判断
+    alpha: float = 0.2
+
+    def __init__(self) -> None:
+        self.in_flight: int = 0
+        self.requests: int = 0
+        self.errors: int = 0
+        self.latency: float = 0.0
+
+    def record(self, cost: float, success: bool) -> None:
+        self.requests += 1
+        if not success:
+            self.errors += 1
+        if self.requests == 1:
+            self.latency = cost
+        else:
+            self.latency = self.alpha * cost + (1 - self.alpha) * self.latency
+
+    def to_dict(self) -> dict:
+        return {
+            'in_flight': self.in_flight, 'requests': self.requests,
+            'errors': self.errors, 'latency': round(self.latency, 4)
+        }
+
+
+class StatsAiohttpHttpNode(AiohttpHttpNode):
+    stats: dict[str, NodeStats] = {}
+
+    async def perform_request(self, *args: Any, **kwargs: Any) -> Any:
+        stats: NodeStats = self.stats.setdefault(self.base_url, NodeStats())
+        stats.in_flight += 1
+        start: float = time.perf_counter()
+        success: bool = False
+        try:
+            response = await super().perform_request(*args, **kwargs)
+            success = True
+            return response
+        finally:
+            stats.in_flight -= 1
+            stats.record(time.perf_counter() - start, success)
+
+
+@singleton
+class ESClient(object):
+    def __init__(self) -> None:
+        self._client: Optional[AsyncElasticsearch] = None
+
+    @staticmethod
+    def _build() -> AsyncElasticsearch:
+        config = settings.ES
+        hosts: list[str] = [h.strip() for h in config.HOSTS.split(',') if h.strip()]
+        return AsyncElasticsearch(
+            hosts=hosts,
+            node_class=StatsAiohttpHttpNode,
+            connections_per_node=config.CONNECTIONS_PER_NODE,
+            request_timeout=config.REQUEST_TIMEOUT,
+            max_retries=config.MAX_RETRIES,
+            retry_on_timeout=config.RETRY_ON_TIMEOUT,
+            http_compress=config.HTTP_COMPRESS,
+            node_selector_class=config.NODE_SELECTOR,
+            sniff_on_start=config.SNIFF_ON_START,
+        )
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = self._build()
+            logger.info(f'Elasticsearch client started: {settings.ES.HOSTS}')
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            logger.info('Elasticsearch client closed')
+
+    @property
+    def client(self) -> AsyncElasticsearch:
+        if self._client is None:
+            raise RuntimeError(_('Elasticsearch client is not started'))
+        return self._client
+
+    @staticmethod
+    def stats() -> dict:
+        return {
+            node: stats.to_dict() for node, stats in StatsAiohttpHttpNode.stats.items()
+        }
+
+
+class ClientDescriptor(object):
+    # 模型通过 cls._client 访问时再取共享客户端，客户端的生命周期由应用控制
+    def __get__(self, instance: Any, owner: Any) -> AsyncElasticsearch:
+        return ESClient().client
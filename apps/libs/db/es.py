@@ -1,102 +1,174 @@
 import asyncio
-import uuid
-import inspect
+import base64
+import json
 
-from enum import Enum
-
-from datetime import datetime
 from gettext import gettext as _
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 
-from elasticsearch import AsyncElasticsearch
 from elastic_transport import ObjectApiResponse
 from fastapi.exceptions import ValidationException
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from pydantic.fields import FieldInfo
 
 from settings import settings
-from common.utils import singleton, get_logger, random_string
+from common.utils import get_logger
 from common.fields import EncryptedField
+from .cache import ESCache
+from .client import ClientDescriptor
+from .query import ESQuery
+from .schema import ESSchema
+from .validation import ESValidator
 
 
 logger = get_logger()
 
 
 class ESQuerySet(object):
-    def __init__(self, data: dict, model: BaseModel) -> None:
+    # 惰性结果集：链式调用只拼装查询，await 或迭代时才真正请求 ES
+    def __init__(
+            self, model: Any, query: Optional[ESQuery] = None,
+            params: Optional[dict] = None
+    ) -> None:
         self._model = model
-        self._data: list = data['data']
-        self._length: int = data['total']
+        self._query: ESQuery = query or ESQuery(model)
+        self._params: dict = params or {}
+        self._result: Optional[dict] = None
+
+    def _clone(self, query: Optional[ESQuery] = None, **params: Any) -> 'ESQuerySet':
+        return self.__class__(
+            self._model, query or self._query, {**self._params, **params}
+        )
+
+    def filter(self, **lookups: Any) -> 'ESQuerySet':
+        return self._clone(self._query.filter(**lookups))
+
+    def exclude(self, **lookups: Any) -> 'ESQuerySet':
+        return self._clone(self._query.exclude(**lookups))
+
+    def order_by(self, *fields: str) -> 'ESQuerySet':
+        return self._clone(self._query.order_by(*fields))
+
+    def only(self, *fields: str) -> 'ESQuerySet':
+        return self._clone(self._query.only(*fields))
+
+    def __getitem__(self, item: slice | int) -> 'ESQuerySet | BaseModel':
+        if isinstance(item, int):
+            return self._build_model(self.data[item])
+        if item.step is not None or (item.start or 0) < 0 or item.stop is None:
+            raise ValueError(_('Only slices with non-negative start and stop are supported'))
+
+        start: int = item.start or 0
+        return self._clone(offset=start, size=max(item.stop - start, 0), page=None)
+
+    async def fetch(self) -> 'ESQuerySet':
+        if self._result is None:
+            self._result = await self._model._list(dict(self._params), self._query)
+        return self
+
+    def __await__(self):
+        return self.fetch().__await__()
+
+    async def count(self) -> int:
+        if self._result is not None:
+            return self._result['total']
+        return await self._model._count(dict(self._params), self._query)
+
+    def _build_model(self, data: dict) -> BaseModel:
+        # 只取了部分字段时跳过校验，避免缺失的必填字段报错
+        if self._query.to_body().get('_source') is not None:
+            return self._model.model_construct(**data)
+        return self._model(**data)
+
+    def __iter__(self):
+        for data in self.data:
+            yield self._build_model(data)
+
+    async def __aiter__(self):
+        # 未切片时用 point-in-time 分批遍历全部结果，否则只遍历当前页
+        if self._result is None and 'size' not in self._params:
+            params: dict = {
+                k: v for k, v in self._params.items() if k not in ('page', 'cursor')
+            }
+            async for batch in self._model._iter_batches(params, query=self._query):
+                for data in batch:
+                    yield self._build_model(data)
+            return
+
+        await self.fetch()
+        for instance in self:
+            yield instance
+
+    def _get_result(self) -> dict:
+        if self._result is None:
+            raise RuntimeError(_('The queryset has not been fetched, await it first'))
+        return self._result
 
     def __len__(self):
-        return self._length
+        return self._get_result()['total']
 
     @property
-    def data(self):
-        return self._data
-
+    def data(self) -> list[dict]:
+        return self._get_result()['data']
 
-@singleton
-class ESClient(object):
-    @staticmethod
-    def get_client() -> AsyncElasticsearch:
-        return AsyncElasticsearch(
-            hosts=settings.ES.HOSTS,
-        )
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return self._result.get('next_cursor') if self._result else None
 
 
 class ESManager(object):
-    _client: AsyncElasticsearch = ESClient().get_client()
-    _mapping: dict = {}
+    _client = ClientDescriptor()
+    _schema: Optional[ESSchema] = None
+    # 按索引名登记所有模型，多个模型(如 Asset 与 Worker)共用同一索引时映射取并集
+    _table_models: dict[str, list[type]] = {}
+    # search_after 需要稳定且唯一的排序，id 作为 create_time 相同时的决胜字段
+    _stable_sort: list = [{'create_time': 'asc'}, {'id': 'asc'}]
 
     @classmethod
-    async def _need_set_keyword(cls: 'RootModel | ESManager', field_name: str, field_info: FieldInfo):
-        is_keyword = False
-        if field_info.annotation is uuid.UUID:
-            is_keyword = True
-        elif inspect.isclass(field_info.annotation) and \
-                issubclass(field_info.annotation, Enum):
-            is_keyword = True
-        elif field_info.json_schema_extra and \
-                field_info.json_schema_extra.get('index', False):
-            is_keyword = True
-        elif field_name in cls.Config.index_fields:
-            is_keyword = True
-        elif field_name in cls.Config.unique_fields:
-            is_keyword = True
-        return is_keyword
+    def _compile_schema(cls: 'BaseModel | ESManager') -> None:
+        # 每个模型类持有自己的编译结果，避免子类共用父类的映射
+        cls._schema = ESSchema(cls)
+        if cls._schema.table_name:
+            ESManager._table_models.setdefault(cls._schema.table_name, []).append(cls)
 
     @classmethod
     async def get_mapping(cls: 'BaseModel | ESManager') -> dict:
-        if not cls._mapping:
-            properties = {}
-            for name, field in cls.model_fields.items():
-                _type_name, _type = 'type', 'text'
-                if field.annotation is datetime:
-                    _type = 'date'
-                elif await cls._need_set_keyword(name, field):
-                    _type = 'keyword'
-                elif field.json_schema_extra:
-                    if mapping := field.json_schema_extra.get('es_mapping'):
-                        _type_name = 'properties'
-                        _type = {k: {'type': v} for k, v in mapping.items()}
-                properties[name] = {_type_name: _type}
-            cls._mapping = {'mappings': {'properties': properties}}
-        return cls._mapping
+        mapping: dict = cls._schema.mapping
+        properties: dict = mapping['mappings']['properties']
+        for model in ESManager._table_models.get(cls._schema.table_name, []):
+            for name, value in model._schema.mapping['mappings']['properties'].items():
+                properties.setdefault(name, value)
+        return mapping
 
     @classmethod
     async def get_table_name(cls: 'BaseModel | ESManager'):
-        table_name: str = cls.model_config.get('table_name', '')
+        table_name: str = cls._schema.table_name if cls._schema else ''
         if not table_name:
             raise ValueError(_('%s model_config no attribute table_name') % (cls,))
         return table_name
 
+    @staticmethod
+    async def _versioned_index_name(index_name: str, version: int) -> str:
+        return f'{index_name}_v{version}'
+
+    @classmethod
+    async def _get_physical_index(cls, index_name: str) -> tuple[str, int]:
+        # 返回别名当前指向的物理索引及其版本号，版本 0 表示尚未使用别名的旧索引
+        if not await cls._client.indices.exists_alias(name=index_name):
+            return index_name, 0
+
+        response: ObjectApiResponse[Any] = await cls._client.indices.get_alias(
+            name=index_name
+        )
+        physical_index: str = next(iter(response.keys()))
+        version: str = physical_index.rsplit('_v', 1)[-1]
+        return physical_index, int(version) if version.isdigit() else 0
+
     @classmethod
     async def ensure_index_exist(cls: 'BaseModel | ESManager', index_name: str) -> None:
         logger.info(f'Start to check whether {index_name} exists')
 
         try:
+            # 别名和旧的同名物理索引都会返回 True
             exist = await cls._client.indices.exists(index=index_name)
         except Exception as error:
             exist = False
@@ -107,54 +179,84 @@ class ESManager(object):
         if exist:
             return None
 
-        try:
-            await cls._client.indices.create(index=index_name, body=await cls.get_mapping())
-        except Exception as error:
-            raise error
-        else:
-            logger.info(f'Succeeded in creating {index_name}')
+        physical_index: str = await cls._versioned_index_name(index_name, 1)
+        body: dict = {**await cls.get_mapping(), 'aliases': {index_name: {}}}
+        await cls._client.indices.create(index=physical_index, body=body)
+        logger.info(f'Succeeded in creating {physical_index} with alias {index_name}')
+
+    @classmethod
+    async def _wait_reindex(cls, task_id: str, index_name: str) -> dict:
+        while True:
+            response: ObjectApiResponse[Any] = await cls._client.tasks.get(task_id=task_id)
+            status: dict = response['task']['status']
+            done: int = status['created'] + status['updated'] + status['deleted']
+            logger.info(
+                f'Migrating model [{index_name}]: {done}/{status["total"]} documents'
+            )
+            if response.get('completed'):
+                if error := response.get('error'):
+                    raise RuntimeError(f'Reindex {index_name} failed: {error}')
+                if failures := response.get('response', {}).get('failures'):
+                    raise RuntimeError(f'Reindex {index_name} failed: {failures}')
+                return status
+            await asyncio.sleep(settings.ES.REINDEX_POLL_INTERVAL)
 
     @classmethod
     async def ensure_index_uniform(cls: 'BaseModel | ESManager', index_name: str) -> None:
         new_mapping: dict = (await cls.get_mapping())
-        response = await cls._client.indices.get(index=index_name)
-        old_mapping = {'mappings': response[index_name]['mappings']}
+        old_index, old_version = await cls._get_physical_index(index_name)
+        response = await cls._client.indices.get(index=old_index)
+        old_mapping = {'mappings': response[old_index]['mappings']}
         if new_mapping == old_mapping:
             return
 
         logger.debug(f'old mapping: {old_mapping}')
         logger.debug(f'new mapping: {new_mapping}')
         logger.info(f'Start migrating model [{index_name}] mappings')
-        # 查询旧索引数据数量
-        response: ObjectApiResponse = await cls._client.count(index=index_name)
-        old_document_count: int = response['count']
-        logger.debug(f'old_document_count: {old_document_count}')
-        # 创建新索引
-        new_index_name: str = f'{index_name}-{random_string(4, upper=False)}'
-        await cls._client.indices.create(index=new_index_name, body=new_mapping)
-        # 新旧索引替换
-        reindex_body = {
-            'source': {'index': index_name}, 'dest': {'index': new_index_name}
-        }
-        await cls._client.reindex(body=reindex_body, wait_for_completion=True,)
-        # 处理旧索引
-        await cls._client.indices.delete(index=index_name)
-        await cls._client.indices.create(index=index_name, body=new_mapping)
-        reindex_body = {
-            'source': {'index': new_index_name}, 'dest': {'index': index_name}
-        }
-        # 查询新索引数据是否都导入完成
-        new_document_count: int = 0
-        while new_document_count != old_document_count:
-            logger.debug(
-                f'new_document_count({new_document_count}) !='
-                f' old_document_count({old_document_count})'
+        # 迁移期间旧索引只读，写请求直接失败而不是写入旧索引后在切换别名时丢失
+        await cls._client.indices.put_settings(
+            index=old_index, settings={'index': {'blocks': {'write': True}}}
+        )
+        # 新版本物理索引在迁移期间关闭刷新，迁移结束后再恢复
+        new_index: str = await cls._versioned_index_name(index_name, old_version + 1)
+        try:
+            await cls._client.indices.create(
+                index=new_index,
+                body={**new_mapping, 'settings': {'index': {'refresh_interval': '-1'}}}
+            )
+            reindex_body = {
+                'source': {'index': old_index}, 'dest': {'index': new_index},
+                # 旧数据的 _id 由 ES 随机生成，迁移时统一改为模型 id
+                'script': {'source': 'ctx._id = ctx._source.id', 'lang': 'painless'}
+            }
+            response = await cls._client.reindex(
+                body=reindex_body, slices='auto', wait_for_completion=False
             )
-            response: ObjectApiResponse = await cls._client.count(index=new_index_name)
-            new_document_count = response['count']
-            await asyncio.sleep(1)
-        await cls._client.reindex(body=reindex_body, wait_for_completion=True)
-        await cls._client.indices.delete(index=new_index_name)
+            await cls._wait_reindex(response['task'], index_name)
+            await cls._client.indices.put_settings(
+                index=new_index, settings={'index': {'refresh_interval': None}}
+            )
+            await cls._client.indices.refresh(index=new_index)
+        except BaseException:
+            # 迁移失败时恢复旧索引的写入，丢弃未完成的新索引，下次启动重新迁移
+            await cls._client.indices.delete(index=new_index, ignore_unavailable=True)
+            await cls._client.indices.put_settings(
+                index=old_index, settings={'index': {'blocks': {'write': None}}}
+            )
+            raise
+
+        # 别名原子切换，整个过程中读请求不会出现索引不存在的情况
+        if old_version == 0:
+            remove_action: dict = {'remove_index': {'index': old_index}}
+        else:
+            remove_action: dict = {'remove': {'index': old_index, 'alias': index_name}}
+        await cls._client.indices.update_aliases(actions=[
+            {'add': {'index': new_index, 'alias': index_name, 'is_write_index': True}},
+            remove_action
+        ])
+        if old_version != 0:
+            await cls._client.indices.delete(index=old_index)
+        await ESCache().invalidate(index_name, refreshed=True)
         logger.info(f'The migration model [{index_name}] mapping is complete')
 
     @classmethod
@@ -163,71 +265,93 @@ class ESManager(object):
         await cls.ensure_index_exist(table_name)
         await cls.ensure_index_uniform(table_name)
 
+    @classmethod
+    def _get_validator(cls: 'RootModel | ESManager', current_index: str) -> ESValidator:
+        return ESValidator(
+            cls._client, current_index,
+            cls._schema.unique_fields, cls._schema.foreign_fields
+        )
+
     async def _pre_check(
             self: 'RootModel | ESManager', data: dict, current_index: str
     ) -> None:
-        errors: dict = {}
-        unique_fields: tuple = self.Config.unique_fields
-        foreign_fields: dict = self.Config.foreign_fields
-
-        should: list = []
-        for field in unique_fields:
-            if value := data.get(field):
-                should.append({
-                    'bool': {
-                        'must': [
-                            {'term': {field: value}},
-                            {'term': {'_index': current_index}}
-                        ]
-                    }
-                })
-
-        foreign_index = []
-        for field, index_info in foreign_fields.items():
-            index_name, index_primary = index_info
-            foreign_index.append(index_name)
-            if value := data.get(field):
-                should.append({
-                    'bool': {
-                        'must': [
-                            {'term': {index_primary: value}},
-                            {'term': {'_index': index_name}}
-                        ],
-                    }
-                })
-
-        if not should:
-            return
-
-        unique_err = _('Object with this %s already exists.')
-        foreign_err = _('The attribute %s associated with the object does not exist')
+        errors: dict = await self._get_validator(current_index).validate([data])
+        if errors:
+            raise ValidationException(errors[0])
 
-        body = {'query': {'bool': {'should': should}}}
-        response: ObjectApiResponse[Any] = await self._client.search(
-            index=[await self.get_table_name(), *foreign_index], body=body
-        )
-        result: list = response['hits']['hits']
-        if foreign_fields and not result:
-            for field, __ in foreign_fields.items():
-                errors.setdefault(field, [foreign_err % field])
-
-        for item in result:
-            source_data: dict = item['_source']
-            # 检查唯一性
-            for field in unique_fields:
-                if source_data.get(field) == data[field]:
-                    errors.setdefault(field, [unique_err % field])
-            # 检查外键
-            for field, index_info in foreign_fields.items():
-                index_name, index_primary = index_info
-                if index_name != item['_index']:
+    @classmethod
+    async def _bulk_save(
+            cls: 'RootModel | ESManager', documents: list[dict],
+            chunk_size: Optional[int] = None, concurrency: Optional[int] = None,
+            refresh: Optional[str] = None
+    ) -> list[dict]:
+        table_name: str = await cls.get_table_name()
+        chunk_size = chunk_size or settings.ES.BULK_CHUNK_SIZE
+        concurrency = concurrency or settings.ES.BULK_CONCURRENCY
+        documents = [
+            jsonable_encoder(d, custom_encoder={EncryptedField: lambda x: str(x)})
+            for d in documents
+        ]
+        results: list[dict] = [
+            {'id': d.get('id'), 'success': False, 'errors': {}} for d in documents
+        ]
+
+        # 批次内部的唯一性冲突，分块并发写入前统一处理
+        unique_err: str = ESValidator.unique_err
+        for field in cls._schema.unique_fields:
+            seen: set = set()
+            for i, document in enumerate(documents):
+                if not (value := document.get(field)):
                     continue
-
-                if not source_data.get(index_primary):
-                    errors.setdefault(field, [foreign_err % field])
-
-        if errors:
-            raise ValidationException(errors)
+                if value in seen:
+                    results[i]['errors'].setdefault(field, [unique_err % field])
+                seen.add(value)
+
+        validator: ESValidator = cls._get_validator(table_name)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def process_chunk(offset: int) -> None:
+            indexes: list[int] = [
+                i for i in range(offset, min(offset + chunk_size, len(documents)))
+                if not results[i]['errors']
+            ]
+            if not indexes:
+                return
+
+            async with semaphore:
+                chunk: list[dict] = [documents[i] for i in indexes]
+                chunk_errors: dict = await validator.validate(chunk)
+                operations: list = []
+                valid_indexes: list[int] = []
+                for position, i in enumerate(indexes):
+                    if errors := chunk_errors.get(position):
+                        results[i]['errors'] = errors
+                        continue
+                    valid_indexes.append(i)
+                    operations.append({
+                        'index': {'_index': table_name, '_id': documents[i]['id']}
+                    })
+                    operations.append(documents[i])
+                if not operations:
+                    return
+
+                response: ObjectApiResponse[Any] = await cls._client.bulk(
+                    operations=operations, refresh=refresh
+                )
+                for i, item in zip(valid_indexes, response['items']):
+                    if error := item['index'].get('error'):
+                        results[i]['errors'] = {
+                            'non_field_errors': [error.get('reason', str(error))]
+                        }
+                    else:
+                        results[i]['success'] = True
+
+        await asyncio.gather(*[
+            process_chunk(offset) for offset in range(0, len(documents), chunk_size)
+        ])
+        await ESCache().invalidate(table_name, refreshed=refresh in ('true', 'wait_for'))
+        logger.debug(f'Bulk save {table_name}: {len(documents)} documents')
+        return results
 
     async def _save(self: 'RootModel | ESManager', data: dict) -> dict:
         table_name: str = await self.get_table_name()
@@ -235,30 +359,225 @@ class ESManager(object):
             data, custom_encoder={EncryptedField: lambda x: str(x)}
         )
         await self._pre_check(data, table_name)
-        await self._client.index(index=table_name, document=data)
+        await self._client.index(index=table_name, id=data['id'], document=data)
+        await ESCache().invalidate(table_name)
         return data
 
-    @staticmethod
-    async def _build_query_body(params: dict) -> dict:
+    @classmethod
+    async def _delete(cls: 'RootModel | ESManager', ids: list[str]) -> None:
+        table_name: str = await cls.get_table_name()
+        operations: list = [
+            {'delete': {'_index': table_name, '_id': _id}} for _id in ids
+        ]
+        await cls._client.bulk(operations=operations)
+        await ESCache().invalidate(table_name)
+
+    @classmethod
+    async def _get(cls: 'RootModel | ESManager', _id: str) -> Optional[dict]:
+        # get 是实时的，且不需要经过查询解析和打分
+        table_name: str = await cls.get_table_name()
+        response: ObjectApiResponse[Any] = await cls._client.options(
+            ignore_status=404
+        ).get(index=table_name, id=_id)
+        return response['_source'] if response.get('found') else None
+
+    @classmethod
+    async def _get_many(cls: 'RootModel | ESManager', ids: list[str]) -> list[dict]:
+        if not ids:
+            return []
+
+        table_name: str = await cls.get_table_name()
+        response: ObjectApiResponse[Any] = await cls._client.mget(
+            index=table_name, ids=ids
+        )
+        return [doc['_source'] for doc in response['docs'] if doc.get('found')]
+
+    @classmethod
+    async def _build_query_body(
+            cls, params: dict, query: Optional[ESQuery] = None
+    ) -> dict:
         size = params.pop('size', None)
         page = params.pop('page', None)
-        if not params:
-            query_body: dict = {'query': {'match_all': {}}}
-        else:
-            must: list = [{'term': {k: v}} for k, v in params.items()]
-            query_body: dict = {'query': {'bool': {'must': must}}}
-        if size:
+        offset = params.pop('offset', None)
+        ordering = params.pop('ordering', None)
+        query = (query or ESQuery(cls)).filter(**params)
+        if ordering:
+            query = query.order_by(*ordering.split(','))
+        query_body: dict = query.to_body()
+        # 空切片得到 size=0，ES 返回空结果，不能当作未设置
+        if size is not None:
             query_body.update(size=size)
-        if page:
-            size = size or 15
+        if offset is not None:
+            query_body.update({'from': offset})
+        elif page:
+            size = 15 if size is None else size
             query_body.update({'from': (page - 1) * size})
         return query_body
 
+    @staticmethod
+    async def _encode_cursor(pit_id: str, search_after: list) -> str:
+        content: bytes = json.dumps({'pit': pit_id, 'after': search_after}).encode()
+        return base64.urlsafe_b64encode(content).decode()
+
+    @staticmethod
+    async def _decode_cursor(cursor: str) -> tuple[str, list]:
+        try:
+            content: dict = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return content['pit'], content['after']
+        except Exception: # noqa
+            raise ValidationException({'cursor': [_('Invalid cursor')]})
+
+    @classmethod
+    async def _open_pit(cls, index_name: str) -> str:
+        response: ObjectApiResponse[Any] = await cls._client.open_point_in_time(
+            index=index_name, keep_alive=settings.ES.PIT_KEEP_ALIVE
+        )
+        return response['id']
+
+    @classmethod
+    async def _close_pit(cls, pit_id: str) -> None:
+        try:
+            await cls._client.close_point_in_time(id=pit_id)
+        except Exception as error:
+            logger.warning(f'Close point in time failed: {error}')
+
+    @classmethod
+    async def _search_after(
+            cls, body: dict, pit_id: str, search_after: Optional[list] = None
+    ) -> ObjectApiResponse[Any]:
+        body: dict = {
+            'sort': cls._stable_sort, **body,
+            'pit': {'id': pit_id, 'keep_alive': settings.ES.PIT_KEEP_ALIVE},
+        }
+        body.pop('from', None)
+        if search_after:
+            body['search_after'] = search_after
+        return await cls._client.search(body=body)
+
+    @classmethod
+    async def _list_by_cursor(cls, table_name: str, body: dict, cursor: str) -> dict:
+        # 空游标表示开始一次新的遍历
+        if cursor:
+            pit_id, search_after = await cls._decode_cursor(cursor)
+        else:
+            pit_id, search_after = await cls._open_pit(table_name), None
+
+        response: ObjectApiResponse[Any] = await cls._search_after(
+            body, pit_id, search_after
+        )
+        hits: list = response['hits']['hits']
+        pit_id = response.get('pit_id', pit_id)
+        next_cursor: Optional[str] = None
+        if hits and len(hits) >= body.get('size', 10):
+            next_cursor = await cls._encode_cursor(pit_id, hits[-1]['sort'])
+        else:
+            await cls._close_pit(pit_id)
+        return {
+            'data': [hit['_source'] for hit in hits],
+            'total': response['hits']['total']['value'],
+            'next_cursor': next_cursor
+        }
+
     @classmethod
-    async def _list(cls, params: dict) -> dict:
+    async def _iter_batches(
+            cls, params: dict, batch_size: Optional[int] = None,
+            query: Optional[ESQuery] = None
+    ) -> AsyncIterator[list[dict]]:
+        # 基于 point-in-time 分批读取，内存占用只与 batch_size 相关
+        table_name: str = await cls.get_table_name()
+        body: dict = await cls._build_query_body(params, query)
+        body['size'] = batch_size or settings.ES.SCAN_BATCH_SIZE
+        pit_id: str = await cls._open_pit(table_name)
+        search_after: Optional[list] = None
+        try:
+            while True:
+                response: ObjectApiResponse[Any] = await cls._search_after(
+                    body, pit_id, search_after
+                )
+                pit_id = response.get('pit_id', pit_id)
+                hits: list = response['hits']['hits']
+                if hits:
+                    yield [hit['_source'] for hit in hits]
+                if len(hits) < body['size']:
+                    break
+                search_after = hits[-1]['sort']
+        finally:
+            await cls._close_pit(pit_id)
+
+    @classmethod
+    async def _iter_all(
+            cls, params: dict, batch_size: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        async for batch in cls._iter_batches(params, batch_size=batch_size):
+            for data in batch:
+                yield data
+
+    @classmethod
+    async def _count(cls, params: dict, query: Optional[ESQuery] = None) -> int:
+        table_name: str = await cls.get_table_name()
+        params.pop('cursor', None)
+        body: dict = await cls._build_query_body(params, query)
+        response: ObjectApiResponse[Any] = await cls._client.count(
+            index=table_name, body={'query': body['query']}
+        )
+        return response['count']
+
+    @classmethod
+    async def _list_deep(cls, table_name: str, body: dict) -> dict:
+        # from + size 超过 max_result_window 时，先用 search_after 定位到 from 的位置
+        offset: int = body.pop('from')
+        pit_id: str = await cls._open_pit(table_name)
+        search_after: Optional[list] = None
+        try:
+            while offset > 0:
+                skip_body: dict = {
+                    **body, '_source': False, 'track_total_hits': False,
+                    'size': min(offset, settings.ES.MAX_RESULT_WINDOW)
+                }
+                response: ObjectApiResponse[Any] = await cls._search_after(
+                    skip_body, pit_id, search_after
+                )
+                pit_id = response.get('pit_id', pit_id)
+                hits: list = response['hits']['hits']
+                if not hits:
+                    # 跳过阶段不统计总数，偏移超出结果集时单独计数
+                    total: int = (await cls._client.count(
+                        index=table_name, body={'query': body['query']}
+                    ))['count']
+                    return {'data': [], 'total': total}
+                offset -= len(hits)
+                search_after = hits[-1]['sort']
+
+            response: ObjectApiResponse[Any] = await cls._search_after(
+                body, pit_id, search_after
+            )
+            pit_id = response.get('pit_id', pit_id)
+        finally:
+            await cls._close_pit(pit_id)
+        return {
+            'data': [hit['_source'] for hit in response['hits']['hits']],
+            'total': response['hits']['total']['value']
+        }
+
+    @classmethod
+    async def _list(cls, params: dict, query: Optional[ESQuery] = None) -> dict:
         table_name = await cls.get_table_name()
-        body: dict = await cls._build_query_body(params)
+        cursor: Optional[str] = params.pop('cursor', None)
+        body: dict = await cls._build_query_body(params, query)
+        # 默认总数最多统计到 10000，分页需要准确的总数
+        body['track_total_hits'] = True
         logger.debug(f'List query body: {body}')
+        if cursor is not None:
+            return await cls._list_by_cursor(table_name, body, cursor)
+
+        body.setdefault('sort', cls._stable_sort)
+        generation: int = ESCache().generation(table_name)
+        if result := await ESCache().get(table_name, body):
+            return result
+
+        if body.get('from', 0) + body.get('size', 10) > settings.ES.MAX_RESULT_WINDOW:
+            return await cls._list_deep(table_name, body)
+
         response: ObjectApiResponse[Any] = await cls._client.search(
             index=table_name, body=body
         )
@@ -266,4 +585,5 @@ class ESManager(object):
             'data': [hit['_source'] for hit in response['hits']['hits']],
             'total': response["hits"]["total"]["value"]
         }
+        await ESCache().set(table_name, body, result, generation)
         return result
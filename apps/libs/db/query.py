@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import copy
+
+from gettext import gettext as _
+from typing import Any, Optional
+
+from fastapi.exceptions import ValidationException
+
+
+class ESQuery(object):
+    # 查询条件写作 字段__操作符=值，与 Django ORM 的写法保持一致
+    lookup_sep: str = '__'
+    range_lookups: tuple = ('gt', 'gte', 'lt', 'lte')
+
+    def __init__(self, model: Any) -> None:
+        self._model = model
+        self._filter: list = []
+        self._must_not: list = []
+        self._sort: list = []
+        self._source: Optional[list] = None
+
+    def _clone(self) -> 'ESQuery':
+        query = self.__class__(self._model)
+        query._filter = copy.copy(self._filter)
+        query._must_not = copy.copy(self._must_not)
+        query._sort = copy.copy(self._sort)
+        query._source = copy.copy(self._source)
+        return query
+
+    def _check_field(self, field: str) -> None:
+        if field not in self._model._schema.field_types:
+            raise ValidationException({field: [_('Unsupported query field %s') % field]})
+
+    def _build_clause(self, key: str, value: Any) -> tuple[dict, bool]:
+        # 返回 (查询子句, 是否取反)
+        field, __, lookup = key.partition(self.lookup_sep)
+        lookup = lookup or 'exact'
+        self._check_field(field)
+
+        if lookup == 'exact':
+            if self._model._schema.field_types[field] == 'text':
+                return {'match': {field: value}}, False
+            return {'term': {field: value}}, False
+        if lookup == 'in':
+            values: list = value.split(',') if isinstance(value, str) else list(value)
+            return {'terms': {field: values}}, False
+        if lookup == 'prefix':
+            return {'prefix': {field: value}}, False
+        if lookup == 'match':
+            return {'match': {field: value}}, False
+        if lookup in self.range_lookups:
+            return {'range': {field: {lookup: value}}}, False
+        if lookup == 'exists':
+            return {'exists': {'field': field}}, not value
+        raise ValidationException({key: [_('Unsupported query lookup %s') % lookup]})
+
+    def _add_lookups(self, lookups: dict, negated: bool) -> None:
+        for key, value in lookups.items():
+            if value is None:
+                continue
+            clause, reverse = self._build_clause(key, value)
+            if negated != reverse:
+                self._must_not.append(clause)
+            else:
+                self._filter.append(clause)
+
+    def filter(self, **lookups: Any) -> 'ESQuery':
+        query = self._clone()
+        query._add_lookups(lookups, negated=False)
+        return query
+
+    def exclude(self, **lookups: Any) -> 'ESQuery':
+        query = self._clone()
+        query._add_lookups(lookups, negated=True)
+        return query
+
+    def order_by(self, *fields: str) -> 'ESQuery':
+        query = self._clone()
+        query._sort = []
+        for field in fields:
+            name: str = field.lstrip('-')
+            query._check_field(name)
+            # text 字段经过分词，ES 不支持直接排序
+            if query._model._schema.field_types[name] in ('text', 'object'):
+                raise ValidationException({name: [_('Unsupported sort field %s') % name]})
+            query._sort.append({name: 'desc' if field.startswith('-') else 'asc'})
+        # search_after 要求排序唯一，使用 id 兜底
+        if fields and not any('id' in s for s in query._sort):
+            query._sort.append({'id': 'asc'})
+        return query
+
+    def only(self, *fields: str) -> 'ESQuery':
+        query = self._clone()
+        for field in fields:
+            query._check_field(field)
+        query._source = list(fields)
+        return query
+
+    def to_body(self) -> dict:
+        # 所有条件放在 filter 上下文，ES 可以缓存且不计算评分
+        if not self._filter and not self._must_not:
+            body: dict = {'query': {'match_all': {}}}
+        else:
+            condition: dict = {}
+            if self._filter:
+                condition['filter'] = self._filter
+            if self._must_not:
+                condition['must_not'] = self._must_not
+            body: dict = {'query': {'bool': condition}}
+        if self._sort:
+            body['sort'] = self._sort
+        if self._source is not None:
+            body['_source'] = self._source
+        return body
@@ -0,0 +1,103 @@
+import copy
+import inspect
+import uuid
+
+from datetime import datetime
+from enum import Enum
+from types import MappingProxyType
+from typing import Mapping, Optional, Union, get_args, get_origin
+
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+
+class ESSchema(object):
+    # 模型类创建时编译一次，之后所有读写、校验和迁移逻辑都复用该结果
+    numeric_types: dict = {bool: 'boolean', int: 'long', float: 'double'}
+    __slots__ = (
+        'table_name', 'unique_fields', 'foreign_fields', 'index_fields',
+        'keyword_fields', 'field_types', '_mapping'
+    )
+
+    def __init__(self, model: type[BaseModel]) -> None:
+        config = getattr(model, 'Config', None)
+        self.table_name: str = model.model_config.get('table_name', '')
+        self.unique_fields: tuple = tuple(getattr(config, 'unique_fields', ()))
+        self.foreign_fields: Mapping[str, tuple] = MappingProxyType(
+            dict(getattr(config, 'foreign_fields', {}))
+        )
+        self.index_fields: tuple = tuple(getattr(config, 'index_fields', ()))
+
+        field_types: dict[str, str] = {}
+        properties: dict = {}
+        for name, field in model.model_fields.items():
+            _type_name, _type = 'type', 'text'
+            if self._get_model_type(field.annotation):
+                # 嵌套模型只保存不索引，避免 ES 动态映射导致与编译结果不一致
+                properties[name] = {'type': 'object', 'enabled': False}
+                field_types[name] = 'object'
+                continue
+            if field.annotation is datetime:
+                _type = 'date'
+            elif numeric_type := self._get_numeric_type(field.annotation):
+                _type = numeric_type
+            elif self._need_set_keyword(name, field):
+                _type = 'keyword'
+            elif field.json_schema_extra:
+                if mapping := field.json_schema_extra.get('es_mapping'):
+                    _type_name = 'properties'
+                    _type = {k: {'type': v} for k, v in mapping.items()}
+            properties[name] = {_type_name: _type}
+            field_types[name] = _type if _type_name == 'type' else 'object'
+
+        self.field_types: Mapping[str, str] = MappingProxyType(field_types)
+        self.keyword_fields: frozenset = frozenset(
+            name for name, _type in field_types.items() if _type == 'keyword'
+        )
+        # _meta.doc_id 标记文档 _id 与模型 id 一致，旧索引缺少该标记时会触发迁移
+        self._mapping: dict = {
+            'mappings': {'_meta': {'doc_id': 'id'}, 'properties': properties}
+        }
+
+    @staticmethod
+    def _unwrap_optional(annotation):
+        # Optional[int] 等可空类型按其中的实际类型映射
+        if get_origin(annotation) is Union:
+            args: tuple = tuple(a for a in get_args(annotation) if a is not type(None))
+            annotation = args[0] if len(args) == 1 else None
+        return annotation
+
+    def _get_numeric_type(self, annotation) -> Optional[str]:
+        return self.numeric_types.get(self._unwrap_optional(annotation))
+
+    def _get_model_type(self, annotation) -> Optional[type[BaseModel]]:
+        annotation = self._unwrap_optional(annotation)
+        if inspect.isclass(annotation) and issubclass(annotation, BaseModel):
+            return annotation
+        return None
+
+    def _need_set_keyword(self, field_name: str, field_info: FieldInfo) -> bool:
+        is_keyword = False
+        if field_info.annotation is uuid.UUID:
+            is_keyword = True
+        elif inspect.isclass(field_info.annotation) and \
+                issubclass(field_info.annotation, Enum):
+            is_keyword = True
+        elif field_info.json_schema_extra and \
+                field_info.json_schema_extra.get('index', False):
+            is_keyword = True
+        elif field_name in self.index_fields:
+            is_keyword = True
+        elif field_name in self.unique_fields:
+            is_keyword = True
+        return is_keyword
+
+    @property
+    def mapping(self) -> dict:
+        # 返回副本，避免调用方修改编译结果
+        return copy.deepcopy(self._mapping)
+
+    def __setattr__(self, key, value) -> None:
+        if hasattr(self, key):
+            raise AttributeError(f'{self.__class__.__name__} is immutable')
+        super().__setattr__(key, value)
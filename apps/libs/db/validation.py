@@ -0,0 +1,121 @@
+from gettext import gettext as _
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch
+from elastic_transport import ObjectApiResponse
+
+from .cache import ESCache
+
+
+class ESValidator(object):
+    unique_err: str = _('Object with this %s already exists.')
+    foreign_err: str = _('The attribute %s associated with the object does not exist')
+
+    def __init__(
+            self, client: AsyncElasticsearch, current_index: str,
+            unique_fields: tuple, foreign_fields: dict
+    ) -> None:
+        self._client: AsyncElasticsearch = client
+        self._current_index: str = current_index
+        self._unique_fields: tuple = unique_fields
+        self._foreign_fields: dict = foreign_fields
+
+    def _field_targets(self) -> dict[str, tuple[str, str, bool]]:
+        # {字段名: (索引名, 索引中的字段名, 是否为唯一性校验)}
+        targets: dict = {
+            field: (self._current_index, field, True) for field in self._unique_fields
+        }
+        for field, (index_name, index_primary) in self._foreign_fields.items():
+            targets[field] = (index_name, index_primary, False)
+        return targets
+
+    async def _lookup_cached(
+            self, values: dict[tuple, set], cacheable: set[tuple]
+    ) -> dict[tuple, set]:
+        # 外键存在性可以缓存，唯一性必须实时查询
+        cache = ESCache()
+        found: dict[tuple, set] = {key: set() for key in values}
+        missing: dict[tuple, set] = {}
+        for key, key_values in values.items():
+            index_name, index_field = key
+            for value in key_values:
+                if key in cacheable and await cache.get(
+                        index_name, {'term': {index_field: value}}
+                ):
+                    found[key].add(value)
+                else:
+                    missing.setdefault(key, set()).add(value)
+
+        if missing:
+            generations: dict[str, int] = {
+                index_name: cache.generation(index_name) for index_name, __ in missing
+            }
+            for key, key_values in (await self._lookup(missing)).items():
+                found[key] |= key_values
+                if key not in cacheable:
+                    continue
+                index_name, index_field = key
+                for value in key_values:
+                    await cache.set(
+                        index_name, {'term': {index_field: value}}, True, generations[index_name]
+                    )
+        return found
+
+    async def _lookup(self, values: dict[tuple, set]) -> dict[tuple, set]:
+        # 同一个 (索引, 字段) 只发一个 terms 查询，所有查询合并为一次 msearch
+        keys: list[tuple] = list(values.keys())
+        searches: list = []
+        for index_name, index_field in keys:
+            searches.append({'index': index_name})
+            searches.append({
+                'size': len(values[(index_name, index_field)]),
+                '_source': [index_field],
+                'query': {
+                    'terms': {index_field: list(values[(index_name, index_field)])}
+                }
+            })
+        response: ObjectApiResponse[Any] = await self._client.msearch(searches=searches)
+
+        found: dict[tuple, set] = {}
+        for key, result in zip(keys, response['responses']):
+            index_name, index_field = key
+            # 子查询失败(索引不存在、分片故障等)不能当作没有命中，否则唯一性校验会误放行
+            if result.get('error') or result.get('status', 200) >= 400:
+                raise RuntimeError(
+                    _('Validate %s.%s failed: %s') % (index_name, index_field, result.get('error'))
+                )
+            hits: list = result['hits']['hits']
+            found[key] = {str(hit['_source'].get(index_field)) for hit in hits}
+        return found
+
+    async def validate(self, documents: list[dict]) -> dict[int, dict]:
+        # 返回值为 {文档下标: 错误信息}，错误信息结构与 ValidationException 一致
+        targets: dict = self._field_targets()
+        values: dict[tuple, set] = {}
+        for field, (index_name, index_field, __) in targets.items():
+            for document in documents:
+                if value := document.get(field):
+                    values.setdefault((index_name, index_field), set()).add(str(value))
+
+        if not values:
+            return {}
+
+        cacheable: set[tuple] = {
+            (index_name, index_field)
+            for index_name, index_field, is_unique in targets.values() if not is_unique
+        } - {
+            (index_name, index_field)
+            for index_name, index_field, is_unique in targets.values() if is_unique
+        }
+        found: dict[tuple, set] = await self._lookup_cached(values, cacheable)
+        errors: dict[int, dict] = {}
+        for i, document in enumerate(documents):
+            for field, (index_name, index_field, is_unique) in targets.items():
+                if not (value := document.get(field)):
+                    continue
+                exists: bool = str(value) in found[(index_name, index_field)]
+                if is_unique and exists:
+                    errors.setdefault(i, {})[field] = [self.unique_err % field]
+                elif not is_unique and not exists:
+                    errors.setdefault(i, {})[field] = [self.foreign_err % field]
+        return errors
@@ -1,14 +1,20 @@
 import asyncio
+import base64
+import hashlib
+import hmac
+import json
 import os
 import random
 import string
 
-import requests
+import aiohttp
 import aiofiles
 
-from typing import Optional
+from email.utils import formatdate
+from typing import Any, Optional
 
 from pydantic import BaseModel, Field
+from yarl import URL
 
 from settings import settings
 from common.utils import get_logger, singleton
@@ -17,6 +23,13 @@ from common.utils import get_logger, singleton
 logger = get_logger()
 
 
+class JumpServerError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None, body: Any = None) -> None:
+        super().__init__(message)
+        self.status: Optional[int] = status
+        self.body: Any = body
+
+
 class AccessKey(BaseModel):
     id_: Optional[str] = Field(default=None, alias='id')
     secret: Optional[str] = None
@@ -32,11 +45,16 @@ class RegisterResponse(BaseModel):
 
 @singleton
 class JumpServerClient:
+    # 可以安全重放的请求方法，POST 只在请求未发出(连接失败)时重试
+    idempotent_methods: tuple = ('GET', 'HEAD', 'PUT', 'PATCH', 'DELETE')
+    retry_statuses: tuple = (429, 502, 503, 504)
+
     def __init__(self):
-        self.base_url: str = settings.APP.CORE_HOST
+        self.base_url: str = settings.APP.CORE_HOST.rstrip('/')
         self.key_path: str = os.path.join(settings.DATA_DIR, 'keys')
         self.key_file: str = os.path.join(self.key_path, '.access_key')
         self.access_key: Optional[AccessKey] = None
+        self._session: Optional[aiohttp.ClientSession] = None
 
     async def check(self) -> None:
         await self._load_auth()
@@ -65,9 +83,124 @@ class JumpServerClient:
         async with aiofiles.open(self.key_file, 'w')as writer:
             await writer.write(f'{self.access_key.id_}:{self.access_key.secret}')
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        # 所有访问 Core 的请求共用一个会话，连接保持 keep-alive 复用
+        if self._session is None or self._session.closed:
+            config = settings.APP
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=config.CORE_MAX_CONNECTIONS,
+                    keepalive_timeout=config.CORE_KEEPALIVE_TIMEOUT
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=config.CORE_REQUEST_TIMEOUT,
+                    connect=config.CORE_CONNECT_TIMEOUT
+                )
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _sign(self, method: str, url: URL, headers: dict) -> None:
+        # 与 Core 的 access key 认证一致，使用 HTTP Signatures(hmac-sha256) 签名
+        headers['Date'] = formatdate(usegmt=True)
+        signing: str = '\n'.join([
+            f'(request-target): {method.lower()} {url.raw_path_qs}',
+            f'accept: {headers.get("Accept", "application/json")}',
+            f'date: {headers["Date"]}',
+        ])
+        digest: bytes = hmac.new(
+            self.access_key.secret.encode(), signing.encode(), hashlib.sha256
+        ).digest()
+        headers['Authorization'] = (
+            f'Signature keyId="{self.access_key.id_}",algorithm="hmac-sha256",'
+            f'headers="(request-target) accept date",'
+            f'signature="{base64.b64encode(digest).decode()}"'
+        )
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        config = settings.APP
+        delay: float = min(config.CORE_RETRY_BACKOFF * 2 ** attempt, config.CORE_RETRY_BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1)
+
+    @staticmethod
+    def _parse_body(text: str) -> Any:
+        if not text:
+            return None
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+
+    async def request(
+            self, method: str, path: str, *, json: Any = None, params: Optional[dict] = None,
+            headers: Optional[dict] = None, auth: bool = True
+    ) -> Any:
+        method = method.upper()
+        url: URL = URL(f'{self.base_url}{path}')
+        if params:
+            url = url.update_query(params)
+        retries: int = settings.APP.CORE_MAX_RETRIES
+        attempt: int = 0
+        while True:
+            request_headers: dict = {'Accept': 'application/json', **(headers or {})}
+            if auth:
+                if self.access_key is None:
+                    raise JumpServerError('JumpServer client is not registered')
+                # Date 参与签名，每次重试重新签名
+                self._sign(method, url, request_headers)
+            try:
+                async with self._get_session().request(
+                        method, url, json=json, headers=request_headers
+                ) as response:
+                    body: Any = self._parse_body(await response.text())
+                    if response.status < 400:
+                        return body
+                    error: JumpServerError = JumpServerError(
+                        f'{method} {path} failed with status {response.status}',
+                        response.status, body
+                    )
+                    retryable: bool = response.status in self.retry_statuses and \
+                        method in self.idempotent_methods
+            except aiohttp.ClientConnectorError as err:
+                # 连接阶段失败，请求没有到达 Core，任何方法都可以重试
+                error, retryable = JumpServerError(f'{method} {path} failed: {err}'), True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                error = JumpServerError(f'{method} {path} failed: {err!r}')
+                retryable = method in self.idempotent_methods
+
+            if not retryable or attempt >= retries:
+                raise error
+            delay: float = self._backoff(attempt)
+            attempt += 1
+            await logger.warning(f'{error}, retry {attempt}/{retries} in {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+    async def get(self, path: str, **kwargs) -> Any:
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> Any:
+        return await self.request('POST', path, **kwargs)
+
+    async def patch(self, path: str, **kwargs) -> Any:
+        return await self.request('PATCH', path, **kwargs)
+
+    async def push_task_status(self, task_id: str, data: dict) -> Any:
+        return await self.patch(f'/api/v1/behemoth/tasks/{task_id}/', json=data)
+
+    async def push_task_statuses(self, items: list[dict]) -> Any:
+        # 批量更新，每项以 id 标识任务
+        return await self.patch('/api/v1/behemoth/tasks/', json=items)
+
+    async def fetch_commands(self, command_set_id: str) -> list[dict]:
+        return await self.get(f'/api/v1/behemoth/command-sets/{command_set_id}/commands/')
+
     async def register(self) -> None:
         await logger.info('Start register JumpServer client')
-        url = f'{self.base_url}/api/v1/terminal/terminal-registrations/'
         headers = {
             'Authorization': f'BootstrapToken {settings.APP.BOOTSTRAP_TOKEN}'
         }
@@ -75,16 +208,19 @@ class JumpServerClient:
             'name': await self._get_random_name(),
             'comment': 'behemoth', 'type': 'behemoth'
         }
-        response = None
         try:
-            response = requests.post(url, json=data, headers=headers)
-            item = RegisterResponse(**response.json())
+            response = await self.post(
+                '/api/v1/terminal/terminal-registrations/',
+                json=data, headers=headers, auth=False
+            )
+            item = RegisterResponse(**response)
             self.access_key = item.service_account.access_key
             await self._save_to_file()
         except Exception as error:
             await logger.error(f'Register failed: {error};')
-            if getattr(response, 'text', None):
-                await logger.error(f'Response: {response.text}')
+            if body := getattr(error, 'body', None):
+                await logger.error(f'Response: {body}')
+            return
         await logger.info('Registered JumpServer client successfully')
 
     @staticmethod
@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import aiofiles
+import aiofiles.os
+
+from typing import Any, Optional
+
+from settings import settings
+from common.utils import get_logger, singleton
+from .client import jms_client, JumpServerError
+
+
+logger = get_logger()
+
+
+class PendingReport(object):
+    # 同一任务在一个上报周期内的状态变化合并为一条，字段以最新值为准
+    def __init__(self) -> None:
+        self.state: dict = {}
+        self.output: list[str] = []
+        self.output_size: int = 0
+        self.final: bool = False
+
+
+@singleton
+class StatusReporter(object):
+    # 任务状态与输出先缓存在内存，按数量或时间批量上报 Core，Core 不可用时落盘暂存
+    def __init__(self) -> None:
+        self.spool_dir: str = os.path.join(settings.DATA_DIR, 'spool', 'jms')
+        self._pending: dict[str, PendingReport] = {}
+        self._output_size: int = 0
+        self._in_flight: int = 0
+        # 每个任务已上报的输出长度，作为输出片段的偏移量，Core 据此去重
+        self._offsets: dict[str, int] = {}
+        self._sequence = itertools.count()
+        self._space: asyncio.Condition = asyncio.Condition()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._flush_lock: asyncio.Lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping: bool = False
+
+    @property
+    def enabled(self) -> bool:
+        return settings.APP.CORE_REPORT_ENABLED
+
+    def __full(self, task_id: str) -> bool:
+        config = settings.APP
+        if self._output_size >= config.CORE_REPORT_MAX_OUTPUT:
+            return True
+        return task_id not in self._pending and \
+            len(self._pending) + self._in_flight >= config.CORE_REPORT_MAX_PENDING
+
+    async def __acquire(self, task_id: str) -> PendingReport:
+        # 缓冲区满时等待下一次上报释放空间，生产者随之放慢
+        if self.__full(task_id):
+            self._wakeup.set()
+            async with self._space:
+                await self._space.wait_for(lambda: not self.__full(task_id))
+        if len(self._pending) + 1 >= settings.APP.CORE_REPORT_BATCH_SIZE:
+            self._wakeup.set()
+        return self._pending.setdefault(task_id, PendingReport())
+
+    async def report(self, task_id: str, state: dict, final: bool = False) -> None:
+        if not self.enabled:
+            return
+        pending: PendingReport = await self.__acquire(task_id)
+        pending.state.update(state)
+        pending.final = pending.final or final
+
+    async def report_output(self, task_id: str, data: str) -> None:
+        if not self.enabled or not data:
+            return
+        pending: PendingReport = await self.__acquire(task_id)
+        pending.output.append(data)
+        pending.output_size += len(data)
+        self._output_size += len(data)
+
+    def __build(self, batch: dict[str, PendingReport]) -> tuple[list[dict], dict]:
+        # 返回本批数据及发送成功后各任务的新偏移量，None 表示任务已结束，清理偏移量
+        items: list[dict] = []
+        offsets: dict[str, Optional[int]] = {}
+        for task_id, pending in batch.items():
+            item: dict = {'id': task_id, **pending.state}
+            if pending.output:
+                offset: int = self._offsets.get(task_id, 0)
+                item['output'] = {'offset': offset, 'data': ''.join(pending.output)}
+                offsets[task_id] = offset + pending.output_size
+            if pending.final:
+                offsets[task_id] = None
+            items.append(item)
+        return items, offsets
+
+    def __commit(self, offsets: dict[str, Optional[int]]) -> None:
+        for task_id, offset in offsets.items():
+            if offset is None:
+                self._offsets.pop(task_id, None)
+            else:
+                self._offsets[task_id] = offset
+
+    async def __spooled_files(self) -> list[str]:
+        if not os.path.exists(self.spool_dir):
+            return []
+        return sorted(
+            os.path.join(self.spool_dir, name)
+            for name in await aiofiles.os.listdir(self.spool_dir) if name.endswith('.json')
+        )
+
+    async def __spool(self, items: list[dict]) -> None:
+        # 文件名按时间排序，重放时先发送较早的状态，避免旧状态覆盖新状态
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name: str = f'{time.time_ns():020d}-{next(self._sequence):06d}.json'
+        temp_file: str = os.path.join(self.spool_dir, f'.{name}')
+        async with aiofiles.open(temp_file, 'w') as writer:
+            await writer.write(json.dumps(items))
+        await aiofiles.os.rename(temp_file, os.path.join(self.spool_dir, name))
+
+        # 超过暂存上限时丢弃最早的数据
+        files: list[str] = await self.__spooled_files()
+        sizes: list[int] = [os.path.getsize(f) for f in files]
+        total: int = sum(sizes)
+        for file, size in zip(files, sizes):
+            if total <= settings.APP.CORE_REPORT_SPOOL_MAX_SIZE or len(files) <= 1:
+                break
+            logger.warning(f'Report spool exceeds the limit, drop {file}')
+            await aiofiles.os.remove(file)
+            files.remove(file)
+            total -= size
+
+    @staticmethod
+    def __rejected(error: JumpServerError) -> bool:
+        # Core 明确拒绝的数据重发也不会成功，丢弃以免阻塞后续上报；认证类错误仍暂存
+        return error.status is not None and 400 <= error.status < 500 and \
+            error.status not in (401, 403, 408, 429)
+
+    async def __replay(self) -> None:
+        for file in await self.__spooled_files():
+            async with aiofiles.open(file) as reader:
+                content: str = await reader.read()
+            try:
+                items: Any = json.loads(content)
+            except ValueError as error:
+                logger.error(f'Drop broken report spool file {file}: {error}')
+                await aiofiles.os.remove(file)
+                continue
+            try:
+                await jms_client.push_task_statuses(items)
+            except JumpServerError as error:
+                if not self.__rejected(error):
+                    raise
+                logger.error(f'Core rejected spooled task reports {file}: {error}, {error.body}')
+            else:
+                logger.info(f'Replayed {len(items)} spooled task reports')
+            await aiofiles.os.remove(file)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            batch, self._pending = self._pending, {}
+            self._output_size = 0
+            self._in_flight = len(batch)
+            items, offsets = self.__build(batch)
+            try:
+                # 先重放暂存的数据，全部成功后才发送本批，保证状态的先后顺序
+                await self.__replay()
+                if items:
+                    await jms_client.push_task_statuses(items)
+                self.__commit(offsets)
+            except JumpServerError as error:
+                if self.__rejected(error) and items:
+                    logger.error(f'Core rejected {len(items)} task reports: {error}, {error.body}')
+                    # 被拒绝的输出没有送达，偏移量保持不变，后续输出仍与 Core 已收到的部分连续
+                    self.__commit({k: v for k, v in offsets.items() if v is None})
+                elif items:
+                    logger.warning(f'Report {len(items)} tasks to core failed, spooled: {error}')
+                    await self.__spool(items)
+                    self.__commit(offsets)
+            finally:
+                self._in_flight = 0
+                async with self._space:
+                    self._space.notify_all()
+
+    async def __run(self) -> None:
+        # 停止时不取消正在进行的上报，由循环发送完最后一批后退出
+        while True:
+            try:
+                async with asyncio.timeout(settings.APP.CORE_REPORT_FLUSH_INTERVAL):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as error:
+                logger.error(f'Report task status failed: {error}')
+            if self._stopping and not self._pending:
+                return
+
+    async def start(self) -> None:
+        if self.enabled and (self._flusher is None or self._flusher.done()):
+            self._stopping = False
+            self._flusher = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self._flusher is None:
+            return
+        # 退出前把缓冲区中的数据发出，失败时落盘，下次启动后重放
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
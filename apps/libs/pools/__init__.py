@@ -1 +1 @@
-from .worker import *
+from .ssh import *
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+import uuid
+
+from typing import AsyncIterator, AsyncContextManager, Awaitable, Callable, Optional
+
+from asyncssh import SSHClientConnection, SSHClientProcess
+
+from assets.const import TaskFrameType
+from common.utils import get_logger
+
+
+__all__ = ['AgentSession', 'AgentUnavailable']
+
+logger = get_logger()
+
+
+class AgentUnavailable(Exception):
+    pass
+
+
+class AgentSession(object):
+    # 工作机上常驻的脚本进程，独占连接池中的一个 channel
+    # 任务信封逐行写入其标准输入，输出帧按 run 标识分发给对应的任务
+    ready_timeout: float = 10
+
+    def __init__(self, name: str, idle_timeout: float = 0) -> None:
+        self._name: str = name
+        self._idle_timeout: float = idle_timeout
+        self._process: Optional[SSHClientProcess] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._serving: Optional[asyncio.Task] = None
+        self._runs: dict[str, asyncio.Queue] = {}
+        self._last_used: float = time.monotonic()
+        self._closing: bool = False
+
+    def __str__(self):
+        return f'Agent({self._name})'
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and not self._closing
+
+    async def start(
+            self, connect: Callable[[], AsyncContextManager[SSHClientConnection]],
+            prepare: Callable[[SSHClientConnection], Awaitable[str]]
+    ) -> None:
+        self._ready = asyncio.get_running_loop().create_future()
+        self._serving = asyncio.create_task(self.__serve(connect, prepare))
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), self.ready_timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def __serve(
+            self, connect: Callable[[], AsyncContextManager[SSHClientConnection]],
+            prepare: Callable[[SSHClientConnection], Awaitable[str]]
+    ) -> None:
+        error: str = ''
+        try:
+            async with connect() as conn:
+                command: str = await prepare(conn)
+                async with conn.create_process(command) as process:
+                    stderr: asyncio.Task = asyncio.create_task(process.stderr.read())
+                    idle: asyncio.Task = asyncio.create_task(self.__close_idle(process))
+                    try:
+                        async for line in process.stdout:
+                            self.__dispatch(process, line)
+                    finally:
+                        idle.cancel()
+                        self._process = None
+                    error = (await stderr)[-4096:]
+        except Exception as err:
+            error = str(err)
+        finally:
+            self._process = None
+            if not self._ready.done():
+                self._ready.set_exception(AgentUnavailable(error or 'Agent exited'))
+            elif not self._closing:
+                logger.warning(f'{self} exited unexpectedly: {error}')
+            # 进程退出时仍在执行的任务收到 None，由调用方补发结束帧
+            for queue in self._runs.values():
+                queue.put_nowait(None)
+            self._runs.clear()
+
+    def __dispatch(self, process: SSHClientProcess, line: str) -> None:
+        try:
+            frame: dict = json.loads(line)
+            frame_type: str = frame['type']
+        except (ValueError, TypeError, KeyError):
+            logger.debug(f'{self} unexpected output: {line.rstrip()}')
+            return
+
+        if frame_type == 'agent_ready':
+            self._process = process
+            if not self._ready.done():
+                self._ready.set_result(frame.get('pid'))
+            return
+        if (queue := self._runs.get(frame.pop('run', None))) is None:
+            # 已放弃的任务的剩余输出直接丢弃
+            if frame_type == 'agent_error':
+                logger.warning(f'{self} reported: {frame.get("data")}')
+            return
+        try:
+            frame['type'] = TaskFrameType(frame_type)
+        except ValueError:
+            frame = {'type': TaskFrameType.output, 'stream': 'stdout', 'data': line.rstrip('\n')}
+        queue.put_nowait(frame)
+
+    async def __close_idle(self, process: SSHClientProcess) -> None:
+        # 长时间没有任务时关闭标准输入，脚本取消剩余任务后自行退出
+        if self._idle_timeout <= 0:
+            return
+        while True:
+            await asyncio.sleep(self._idle_timeout / 2)
+            if not self._runs and time.monotonic() - self._last_used > self._idle_timeout:
+                logger.debug(f'{self} idle for {self._idle_timeout}s, closing')
+                self._closing = True
+                process.stdin.write_eof()
+                return
+
+    def __send(self, envelope: dict) -> None:
+        self._process.stdin.write(json.dumps(envelope) + '\n')
+
+    async def run(self, envelope: dict) -> AsyncIterator[dict]:
+        # 信封发出前发现进程不可用时抛出 AgentUnavailable，调用方可回退为一次性执行
+        if not self.alive:
+            raise AgentUnavailable(f'{self} is not running')
+        run_id: str = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._runs[run_id] = queue
+        self._last_used = time.monotonic()
+        start: float = time.monotonic()
+        finished: bool = False
+        try:
+            self.__send({'type': 'run', 'id': run_id, **envelope})
+            while (frame := await queue.get()) is not None:
+                finished = frame['type'] == TaskFrameType.task_end
+                yield frame
+                if finished:
+                    return
+            yield {'type': TaskFrameType.error, 'data': f'{self} exited during the task'}
+            yield {
+                'type': TaskFrameType.task_end, 'exit_code': None,
+                'duration': round(time.monotonic() - start, 3)
+            }
+        finally:
+            self._runs.pop(run_id, None)
+            self._last_used = time.monotonic()
+            if not finished and self._process is not None:
+                # 调用方中途放弃时通知脚本取消该任务
+                self.__send({'type': 'cancel', 'id': run_id})
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._process is not None:
+            self._process.stdin.write_eof()
+        if self._serving is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._serving), self.ready_timeout)
+            except Exception:
+                self._serving.cancel()
@@ -0,0 +1,39 @@
+import random
+import time
+
+from typing import Optional
+
+
+__all__ = ['WorkerHealth']
+
+
+class WorkerHealth(object):
+    # 记录工作机最近一次探测结果，失败的工作机按指数退避并加随机抖动后再探测
+    def __init__(self) -> None:
+        self.healthy: Optional[bool] = None
+        self.checked_at: float = 0.0
+        self.next_check: float = 0.0
+        self.failures: int = 0
+
+    def fresh(self, ttl: float) -> bool:
+        return self.healthy is not None and time.monotonic() - self.checked_at < ttl
+
+    def record(self, healthy: bool, interval: float, backoff_max: float) -> None:
+        now: float = time.monotonic()
+        self.healthy = healthy
+        self.checked_at = now
+        if healthy:
+            self.failures = 0
+            delay: float = interval
+        else:
+            self.failures += 1
+            delay: float = min(interval * 2 ** (self.failures - 1), backoff_max)
+        # 抖动避免大量工作机在同一时刻被集中探测
+        self.next_check = now + delay * random.uniform(0.8, 1.2)
+
+    def to_dict(self) -> dict:
+        return {
+            'healthy': self.healthy, 'failures': self.failures,
+            'checked_ago': round(time.monotonic() - self.checked_at, 2)
+            if self.checked_at else None
+        }
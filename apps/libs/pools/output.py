@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import time
+
+from typing import AsyncIterator, Optional
+
+from assets.const import TaskFrameType
+from assets.models import TaskOutput
+from common.utils import singleton, get_logger
+from settings import settings
+
+
+logger = get_logger()
+
+
+class OutputChannel(object):
+    # 单个任务的输出通道：未落库的帧暂存在 pending，同时推送给实时订阅者
+    def __init__(self) -> None:
+        self.sequence = itertools.count()
+        self.pending: list[TaskOutput] = []
+        # 已写入但可能尚未刷新可见的帧，保留到索引刷新之后，供订阅者补齐
+        self.flushed: list[TaskOutput] = []
+        self.visible_at: float = 0
+        self.flusher: Optional[asyncio.Task] = None
+        self.wakeup: asyncio.Event = asyncio.Event()
+        self.subscribers: set[asyncio.Queue] = set()
+        self.flush_lock: asyncio.Lock = asyncio.Lock()
+        self.flushed_at: float = time.monotonic()
+        self.closed: bool = False
+
+
+@singleton
+class TaskOutputHub(object):
+    def __init__(self) -> None:
+        self._channels: dict[str, OutputChannel] = {}
+
+    async def open(self, task_id: str) -> None:
+        self._channels.setdefault(task_id, OutputChannel())
+
+    async def publish(self, task_id: str, frame: dict) -> TaskOutput:
+        channel: OutputChannel = self._channels.setdefault(task_id, OutputChannel())
+        output: TaskOutput = TaskOutput(
+            task_id=task_id, seq=next(channel.sequence), **frame
+        )
+        channel.pending.append(output)
+        config = settings.WORKER
+        for queue in list(channel.subscribers):
+            if queue.qsize() >= config.OUTPUT_SUBSCRIBER_QUEUE:
+                # 消费过慢的订阅者被摘除，之后重新订阅并从已落库的数据补齐
+                channel.subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(output)
+
+        # 落库在后台进行，发布方不等待 ES 写入
+        if len(channel.pending) >= config.OUTPUT_BATCH_SIZE:
+            channel.wakeup.set()
+        if channel.flusher is None or channel.flusher.done():
+            channel.flusher = asyncio.create_task(self.__run_flusher(channel))
+        return output
+
+    async def __run_flusher(self, channel: OutputChannel) -> None:
+        # 通道有未落库的帧时常驻，攒满一批或距上次落库超过间隔时落库，任务不再输出也能按时写入
+        while channel.pending and not channel.closed:
+            delay: float = settings.WORKER.OUTPUT_FLUSH_INTERVAL - \
+                (time.monotonic() - channel.flushed_at)
+            if delay > 0:
+                try:
+                    async with asyncio.timeout(delay):
+                        await channel.wakeup.wait()
+                except TimeoutError:
+                    pass
+            channel.wakeup.clear()
+            try:
+                await self.__flush(channel)
+            except Exception as error:
+                # 失败的帧仍留在 pending 中，下一个间隔重试
+                logger.error(f'Failed to persist task output: {error}')
+
+    @staticmethod
+    async def __flush(channel: OutputChannel, refresh: Optional[str] = None) -> None:
+        async with channel.flush_lock:
+            batch: list[TaskOutput] = list(channel.pending)
+            channel.flushed_at = time.monotonic()
+            if channel.flushed and channel.flushed_at >= channel.visible_at:
+                channel.flushed.clear()
+            if not batch:
+                return
+            results: list[dict] = await TaskOutput.bulk_save(batch, refresh=refresh)
+            if failed := [r for r in results if not r['success']]:
+                logger.error(f'Failed to persist {len(failed)} task output frames: {failed[0]}')
+            del channel.pending[:len(batch)]
+            if refresh == 'wait_for':
+                # 刷新使此前写入的帧一并可见
+                channel.flushed.clear()
+            else:
+                channel.flushed.extend(batch)
+                channel.visible_at = time.monotonic() + settings.ES.INDEX_REFRESH_INTERVAL
+
+    async def close(self, task_id: str) -> None:
+        if (channel := self._channels.get(task_id)) is None:
+            return
+        channel.closed = True
+        channel.wakeup.set()
+        try:
+            if channel.flusher is not None:
+                await asyncio.gather(channel.flusher, return_exceptions=True)
+            # 最后一次落库等待刷新，返回后全部输出都可查询
+            await self.__flush(channel, refresh='wait_for')
+            # 最后一批为空时没有触发刷新，等待后台写入的帧随索引刷新可见
+            if channel.flushed and (delay := channel.visible_at - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+        except Exception as error:
+            # 落库失败不影响调用方结束任务和上报最终状态
+            logger.error(f'Failed to persist task output of {task_id}: {error}')
+        finally:
+            self._channels.pop(task_id, None)
+            for queue in channel.subscribers:
+                queue.put_nowait(None)
+
+    async def follow(self, task_id: str, after: int = -1) -> AsyncIterator[TaskOutput]:
+        # 先回放已落库的帧，再读取 pending 与实时帧，按 seq 去重
+        last: int = after
+        while True:
+            channel: Optional[OutputChannel] = self._channels.get(task_id)
+            queue: Optional[asyncio.Queue] = None
+            pending: list[TaskOutput] = []
+            if channel is not None:
+                if not channel.closed:
+                    queue = asyncio.Queue()
+                    channel.subscribers.add(queue)
+                pending = channel.flushed + channel.pending
+            try:
+                outputs = TaskOutput.query().filter(task_id=task_id, seq__gt=last)
+                async for output in outputs.order_by('seq'):
+                    last = output.seq
+                    yield output
+                for output in pending:
+                    if output.seq > last:
+                        last = output.seq
+                        yield output
+                if queue is None:
+                    return
+
+                # 收到 None 表示任务结束或订阅被摘除，重新进入循环补齐剩余数据
+                while (output := await queue.get()) is not None:
+                    if output.seq > last:
+                        last = output.seq
+                        yield output
+                    if output.type == TaskFrameType.task_end:
+                        return
+            finally:
+                if queue is not None:
+                    channel.subscribers.discard(queue)
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+
+from typing import Any, Optional
+
+
+__all__ = [
+    'WorkerLoad', 'WorkerScheduler', 'SchedulingStrategy', 'LeastInFlightStrategy',
+    'WeightedRoundRobinStrategy', 'LatencyAwareStrategy', 'get_strategy',
+]
+
+
+class WorkerLoad(object):
+    # 任务耗时使用 EWMA 平滑，最近的任务权重更高
+    alpha: float = 0.3
+
+    def __init__(self, worker: Any, slots: int) -> None:
+        self.worker: Any = worker
+        self.slots: int = max(slots, 1)
+        self.in_flight: int = 0
+        self.latency: float = 0.0
+        self.vtime: float = 0.0
+        self.version: int = 0
+
+    @property
+    def worker_id(self) -> str:
+        return str(self.worker.id)
+
+    @property
+    def available(self) -> bool:
+        return self.in_flight < self.slots
+
+    def record(self, duration: float) -> None:
+        if self.latency == 0:
+            self.latency = duration
+        else:
+            self.latency = self.alpha * duration + (1 - self.alpha) * self.latency
+
+
+class SchedulingStrategy(object):
+    name: str = ''
+
+    def key(self, load: WorkerLoad) -> float:
+        raise NotImplementedError
+
+    def on_add(self, load: WorkerLoad, clock: float) -> None:
+        pass
+
+    def on_acquire(self, load: WorkerLoad) -> None:
+        pass
+
+
+class LeastInFlightStrategy(SchedulingStrategy):
+    name = 'least_in_flight'
+
+    def key(self, load: WorkerLoad) -> float:
+        return load.in_flight / load.slots
+
+
+class WeightedRoundRobinStrategy(SchedulingStrategy):
+    # 按声明的槽位数加权轮询：每次被选中后虚拟时间前进 1/slots
+    name = 'weighted_round_robin'
+
+    def key(self, load: WorkerLoad) -> float:
+        return load.vtime
+
+    def on_add(self, load: WorkerLoad, clock: float) -> None:
+        # 新加入的工作机从当前虚拟时间开始，避免短时间内独占所有任务
+        load.vtime = max(load.vtime, clock)
+
+    def on_acquire(self, load: WorkerLoad) -> None:
+        load.vtime += 1 / load.slots
+
+
+class LatencyAwareStrategy(SchedulingStrategy):
+    # 预计等待时间 = 近期任务耗时 * 排队任务数，尚无耗时数据的工作机优先
+    name = 'latency_aware'
+
+    def key(self, load: WorkerLoad) -> float:
+        return load.latency * (load.in_flight + 1) / load.slots
+
+
+STRATEGIES: dict[str, type[SchedulingStrategy]] = {
+    s.name: s for s in (
+        LeastInFlightStrategy, WeightedRoundRobinStrategy, LatencyAwareStrategy
+    )
+}
+
+
+def get_strategy(name: str) -> SchedulingStrategy:
+    if name not in STRATEGIES:
+        raise ValueError(f'Unknown scheduling strategy: {name}')
+    return STRATEGIES[name]()
+
+
+class WorkerScheduler(object):
+    # 小顶堆保存有空闲槽位的工作机，负载变化时压入新条目，旧条目按版本号惰性丢弃
+    def __init__(self, strategy: SchedulingStrategy) -> None:
+        self._strategy: SchedulingStrategy = strategy
+        self._heap: list[tuple] = []
+        self._loads: dict[str, WorkerLoad] = {}
+        self._sequence = itertools.count()
+        self._clock: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self._loads)
+
+    def __contains__(self, worker_id: str) -> bool:
+        return worker_id in self._loads
+
+    def _push(self, load: WorkerLoad) -> None:
+        load.version += 1
+        if load.available:
+            entry: tuple = (
+                self._strategy.key(load), next(self._sequence), load.version, load.worker_id
+            )
+            heapq.heappush(self._heap, entry)
+        if len(self._heap) > 4 * len(self._loads) + 16:
+            self._compact()
+
+    def _compact(self) -> None:
+        self._heap = [
+            entry for entry in self._heap
+            if (load := self._loads.get(entry[3])) and load.version == entry[2]
+        ]
+        heapq.heapify(self._heap)
+
+    def add(self, load: WorkerLoad) -> None:
+        self._strategy.on_add(load, self._clock)
+        self._loads[load.worker_id] = load
+        self._push(load)
+
+    def loads(self) -> list[WorkerLoad]:
+        return list(self._loads.values())
+
+    def remove(self, worker_id: str) -> Optional[WorkerLoad]:
+        return self._loads.pop(worker_id, None)
+
+    def acquire(self) -> Optional[WorkerLoad]:
+        while self._heap:
+            key, __, version, worker_id = heapq.heappop(self._heap)
+            load: Optional[WorkerLoad] = self._loads.get(worker_id)
+            if load is None or load.version != version or not load.available:
+                continue
+
+            self._clock = key
+            load.in_flight += 1
+            self._strategy.on_acquire(load)
+            self._push(load)
+            return load
+        return None
+
+    def release(self, load: WorkerLoad, duration: Optional[float] = None) -> None:
+        load.in_flight = max(load.in_flight - 1, 0)
+        if duration is not None:
+            load.record(duration)
+        if load.worker_id in self._loads:
+            self._push(load)
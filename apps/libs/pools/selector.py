@@ -0,0 +1,83 @@
+import bisect
+
+from collections import Counter
+from typing import Optional
+
+
+__all__ = ['TagIndex']
+
+
+class TagIndex(object):
+    # 精确匹配直接命中；否则按 trigram 相似度模糊匹配，再退化为前缀匹配
+    memo_size: int = 10000
+
+    def __init__(self) -> None:
+        self._tags: set[str] = set()
+        self._sorted_tags: list[str] = []
+        self._trigrams: dict[str, set[str]] = {}
+        self._trigram_count: dict[str, int] = {}
+        self._memo: dict[str, Optional[str]] = {}
+
+    @staticmethod
+    def trigrams(tag: str) -> set[str]:
+        # 前后补空格，保证短标签也能生成 trigram
+        padded: str = f'  {tag.lower()} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self._tags
+
+    def add(self, tag: str) -> None:
+        if tag in self._tags:
+            return
+
+        self._tags.add(tag)
+        bisect.insort(self._sorted_tags, tag)
+        grams: set[str] = self.trigrams(tag)
+        self._trigram_count[tag] = len(grams)
+        for gram in grams:
+            self._trigrams.setdefault(gram, set()).add(tag)
+        self._memo.clear()
+
+    def remove(self, tag: str) -> None:
+        if tag not in self._tags:
+            return
+
+        self._tags.discard(tag)
+        self._sorted_tags.pop(bisect.bisect_left(self._sorted_tags, tag))
+        self._trigram_count.pop(tag, None)
+        for gram in self.trigrams(tag):
+            if tags := self._trigrams.get(gram):
+                tags.discard(tag)
+                if not tags:
+                    self._trigrams.pop(gram)
+        self._memo.clear()
+
+    def _fuzzy_match(self, tag: str) -> Optional[str]:
+        grams: set[str] = self.trigrams(tag)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+
+        if shared:
+            # Dice 系数: 2 * 共同 trigram 数 / 两者 trigram 总数，分数相同时取字典序最小
+            return min(shared, key=lambda t: (
+                -2 * shared[t] / (len(grams) + self._trigram_count[t]), t
+            ))
+
+        index: int = bisect.bisect_left(self._sorted_tags, tag)
+        if index < len(self._sorted_tags) and self._sorted_tags[index].startswith(tag):
+            return self._sorted_tags[index]
+        return None
+
+    def match(self, tag: str) -> Optional[str]:
+        if tag in self._tags:
+            return tag
+        if tag in self._memo:
+            return self._memo[tag]
+
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+        result: Optional[str] = self._fuzzy_match(tag)
+        self._memo[tag] = result
+        return result
@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import asyncssh
+
+from asyncssh import SSHClientConnection, SFTPClient
+
+from settings import settings
+from common.utils import singleton, get_logger
+
+
+__all__ = ['SSHConnectionPool']
+
+logger = get_logger()
+
+
+class PoolSSHClient(asyncssh.SSHClient):
+    def __init__(self) -> None:
+        self.closed: bool = False
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        # keepalive 超时或对端断开时都会回调这里
+        self.closed = True
+
+
+class PooledConnection(object):
+    def __init__(self, conn: SSHClientConnection, client: PoolSSHClient) -> None:
+        self.conn: SSHClientConnection = conn
+        self.client: PoolSSHClient = client
+        self.channels: int = 0
+        self.last_used: float = time.monotonic()
+        self.sftp: Optional[SFTPClient] = None
+        self.sftp_lock: asyncio.Lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return not self.client.closed
+
+    async def start_sftp(self) -> SFTPClient:
+        # 每个连接只打开一个 SFTP 会话，连接上的所有任务共用并流水线化请求
+        async with self.sftp_lock:
+            if self.sftp is None:
+                self.sftp = await self.conn.start_sftp_client()
+        return self.sftp
+
+
+@singleton
+class SSHConnectionPool(object):
+    # 按 (地址, 端口, 用户名) 复用连接，同一连接上通过多个 channel 并发执行
+    def __init__(self) -> None:
+        self._pools: dict[tuple, list[PooledConnection]] = {}
+        self._conditions: dict[tuple, asyncio.Condition] = {}
+        # 正在建立中的连接数，建立连接时不持有锁，先占位以免超过连接数上限
+        self._connecting: dict[tuple, int] = {}
+        self._items: dict[SSHClientConnection, PooledConnection] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def _connect(
+            host: str, port: int, username: str, password: Optional[str]
+    ) -> PooledConnection:
+        config = settings.WORKER
+        conn, client = await asyncssh.create_connection(
+            PoolSSHClient, host=host, port=port, username=username,
+            password=password, known_hosts=None,
+            connect_timeout=config.SSH_CONNECT_TIMEOUT,
+            keepalive_interval=config.SSH_KEEPALIVE_INTERVAL,
+            keepalive_count_max=config.SSH_KEEPALIVE_COUNT_MAX,
+        )
+        logger.debug(f'SSH connection pool connected to {username}@{host}:{port}')
+        return PooledConnection(conn, client)
+
+    async def _acquire(
+            self, key: tuple, password: Optional[str]
+    ) -> PooledConnection:
+        config = settings.WORKER
+        condition: asyncio.Condition = self._conditions.setdefault(key, asyncio.Condition())
+        item: Optional[PooledConnection] = None
+        async with condition:
+            while True:
+                items: list[PooledConnection] = []
+                for i in self._pools.get(key, []):
+                    if i.alive:
+                        items.append(i)
+                    else:
+                        self._items.pop(i.conn, None)
+                self._pools[key] = items
+                available: list = [
+                    i for i in items if i.channels < config.SSH_MAX_CHANNELS
+                ]
+                if available:
+                    item = min(available, key=lambda i: i.channels)
+                    break
+                if len(items) + self._connecting.get(key, 0) < config.SSH_MAX_CONNECTIONS:
+                    self._connecting[key] = self._connecting.get(key, 0) + 1
+                    break
+                await condition.wait()
+
+            if item is not None:
+                item.channels += 1
+                item.last_used = time.monotonic()
+
+        if item is None:
+            # 握手在锁外进行，慢速或失联的主机不会阻塞同一主机上的释放和其他获取
+            try:
+                item = await self._connect(*key, password)
+            except BaseException:
+                async with condition:
+                    self._connecting[key] -= 1
+                    condition.notify_all()
+                raise
+            async with condition:
+                self._connecting[key] -= 1
+                self._pools.setdefault(key, []).append(item)
+                self._items[item.conn] = item
+                item.channels += 1
+                item.last_used = time.monotonic()
+                # 新连接还有空闲 channel，唤醒等待者
+                condition.notify_all()
+        self._ensure_reaper()
+        return item
+
+    async def _release(self, key: tuple, item: PooledConnection) -> None:
+        condition: asyncio.Condition = self._conditions[key]
+        async with condition:
+            item.channels -= 1
+            item.last_used = time.monotonic()
+            condition.notify()
+
+    @asynccontextmanager
+    async def connection(
+            self, host: str, port: int, username: str, password: Optional[str] = None
+    ) -> AsyncIterator[SSHClientConnection]:
+        key: tuple = (host, port, username)
+        item: PooledConnection = await self._acquire(key, password)
+        try:
+            yield item.conn
+        finally:
+            await self._release(key, item)
+
+    async def probe(
+            self, host: str, port: int, username: str, password: Optional[str] = None
+    ) -> None:
+        # 在已有连接上执行一次往返作为存活检测，不计入任务 channel，连接的 channel 占满时也不等待
+        key: tuple = (host, port, username)
+        items: list[PooledConnection] = [i for i in self._pools.get(key, []) if i.alive]
+        if items:
+            item: PooledConnection = min(items, key=lambda i: i.channels)
+            await item.conn.run('true', check=False)
+            return
+        async with self.connection(host, port, username, password) as conn:
+            await conn.run('true', check=False)
+
+    async def sftp(self, conn: SSHClientConnection) -> SFTPClient:
+        return await self._items[conn].start_sftp()
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _reap_idle(self) -> None:
+        # 定期关闭空闲超时或已经断开的连接
+        config = settings.WORKER
+        while self._pools:
+            await asyncio.sleep(config.SSH_IDLE_TIMEOUT / 2)
+            now: float = time.monotonic()
+            for key, items in list(self._pools.items()):
+                async with self._conditions[key]:
+                    keep: list[PooledConnection] = []
+                    for item in items:
+                        idle: bool = item.channels == 0 and \
+                            now - item.last_used > config.SSH_IDLE_TIMEOUT
+                        if item.alive and not idle:
+                            keep.append(item)
+                            continue
+                        self._items.pop(item.conn, None)
+                        item.conn.close()
+                    if keep:
+                        self._pools[key] = keep
+                    else:
+                        self._pools.pop(key, None)
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for items in self._pools.values():
+            for item in items:
+                item.conn.close()
+        self._pools.clear()
+        self._items.clear()
+
+    def stats(self) -> dict:
+        return {
+            f'{username}@{host}:{port}': [i.channels for i in items]
+            for (host, port, username), items in self._pools.items()
+        }
@@ -1,12 +1,28 @@
-from difflib import SequenceMatcher
+import asyncio
+import itertools
+import math
+import time
+import uuid
+
+from collections import OrderedDict
+from datetime import datetime
 from gettext import gettext as _
 from typing import Optional
 
 from fastapi.exceptions import ValidationException
 
+from assets.const import TaskStatus, TaskFrameType
 from assets.models import Worker, Asset
-from assets.serializers import TaskInstance
+from assets.serializers import (
+    TaskInstance, TaskState, BatchTaskInstance, BatchTaskState, BatchAssetResult
+)
 from common.utils import singleton, get_logger
+from libs.jms.reporter import StatusReporter
+from settings import settings
+from .health import WorkerHealth
+from .output import TaskOutputHub
+from .scheduler import WorkerLoad, WorkerScheduler, SchedulingStrategy, get_strategy
+from .selector import TagIndex
 
 
 logger = get_logger()
@@ -15,82 +31,492 @@ logger = get_logger()
 @singleton
 class WorkerPool(object):
     def __init__(self) -> None:
-        self._workers: dict[str, dict[str, Worker]] = {}
-        self._default_workers: dict[str, Worker] = {}
-        self._running_workers: dict[str, Worker] = {}
+        # 按标签分组调度，None 为未设置标签的默认工作机
+        self._groups: dict[Optional[str], WorkerScheduler] = {}
+        self._running_workers: dict[str, tuple[WorkerLoad, float]] = {}
+        # 工作机的负载按 id 保留，移除后重新加入时沿用，仍在执行的任务继续计入 in_flight
+        self._loads: dict[str, WorkerLoad] = {}
         self._useless_workers: dict[str, Worker] = {}
-
-    async def __get_workers(self) -> list[Worker]:
-        default_workers: list = list(self._default_workers.values())
-        other_workers: list = list(self._workers.values())
-        return other_workers + default_workers
+        # 所有已知工作机及其健康状态，健康检查会探测包括不可用在内的全部工作机
+        self._known_workers: dict[str, Worker] = {}
+        self._health: dict[str, WorkerHealth] = {}
+        self._health_checker: Optional[asyncio.Task] = None
+        self._tag_index: TagIndex = TagIndex()
+        self._slot_released: asyncio.Condition = asyncio.Condition()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        # 候选工作机槽位占满的任务暂存于此，有对应标签的槽位释放时重新入队
+        self._parked: dict[int, tuple[tuple, frozenset]] = {}
+        self._consumers: list[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self._states: OrderedDict[str, TaskState] = OrderedDict()
+        self._batch_states: OrderedDict[str, BatchTaskState] = OrderedDict()
+        self._batch_results: dict[str, dict[str, BatchAssetResult]] = {}
+        self._batch_jobs: set[asyncio.Task] = set()
 
     async def add_worker(self, worker: Worker) -> None:
         logger.debug(f'Add a worker： {worker}({worker.tag})')
-        if worker.tag:
-            self._workers[worker.tag][worker.name] = worker
+        self._known_workers[str(worker.id)] = worker
+        self._health.setdefault(str(worker.id), WorkerHealth())
+        group: Optional[WorkerScheduler] = self._groups.get(worker.tag)
+        if group is None:
+            strategy: SchedulingStrategy = get_strategy(settings.WORKER.SCHEDULING_STRATEGY)
+            group = self._groups[worker.tag] = WorkerScheduler(strategy)
+        slots: int = worker.slots or settings.WORKER.MAX_TASKS_PER_WORKER
+        load: Optional[WorkerLoad] = self._loads.get(str(worker.id))
+        if load is None:
+            load = self._loads[str(worker.id)] = WorkerLoad(worker, slots)
         else:
-            self._default_workers[worker.name] = worker
+            if load.worker.tag != worker.tag:
+                await self.remove_worker(load.worker)
+            load.worker, load.slots = worker, max(slots, 1)
+        group.add(load)
+        if worker.tag:
+            self._tag_index.add(worker.tag)
+        self.__resume_parked(worker.tag, load.slots - load.in_flight)
+
+    async def remove_worker(self, worker: Worker) -> None:
+        if group := self._groups.get(worker.tag):
+            group.remove(str(worker.id))
+            if not len(group) and worker.tag:
+                # 标签下已没有工作机时从索引中移除，该标签的资产改为匹配次优的标签
+                # 空分组保留，仍在执行的任务结束时照常归还槽位
+                self._tag_index.remove(worker.tag)
+                self.__resume_parked(worker.tag, len(self._parked))
+
+    async def __candidate_groups(self, asset: Asset) -> list[WorkerScheduler]:
+        groups: list[WorkerScheduler] = []
+        # 根据标签选择工作机，标签索引的匹配结果会被缓存
+        if asset.tag and (tag := self._tag_index.match(asset.tag)):
+            if group := self._groups.get(tag):
+                groups.append(group)
+
+        if group := self._groups.get(None):
+            groups.append(group)
 
-    async def __select_worker(self, asset: Asset) -> Optional[Worker]:
-        worker: Optional[Worker] = None
         if not asset.tag:
-            all_workers: list[Worker] = await self.__get_workers()
-            __, worker = all_workers.pop() if len(all_workers) > 0 else None
-        else:
-            # 根据标签选择工作机
-            minimum_ratio: float = 0
-            for tag in self._workers.keys():
-                ratio: float = SequenceMatcher(None, asset.tag, tag).ratio()
-                if ratio <= minimum_ratio:
-                    continue
-
-                minimum_ratio = ratio
-                if workers := self._workers.get(tag):
-                    __, worker = workers.popitem()
-                else:
-                    break
-
-            if worker is None and not self._default_workers:
-                __, worker = self._default_workers.popitem()
+            groups.extend(g for t, g in self._groups.items() if t is not None)
+        return [g for g in groups if len(g)]
 
-        return worker
+    async def __select_worker(self, asset: Asset) -> Optional[WorkerLoad]:
+        # 组内由调度策略从堆顶取负载最低且有空闲槽位的工作机
+        for group in await self.__candidate_groups(asset):
+            if load := group.acquire():
+                return load
+        return None
+
+    async def __release(self, load: WorkerLoad, duration: Optional[float] = None) -> None:
+        if group := self._groups.get(load.worker.tag):
+            group.release(load, duration)
+        self.__resume_parked(load.worker.tag, load.slots - load.in_flight)
+        async with self._slot_released:
+            self._slot_released.notify_all()
 
-    async def __get_valid_worker(self, asset: Asset) -> Worker:
+    async def __get_valid_worker(
+            self, asset: Asset, key: str, wait: bool = True
+    ) -> Optional[Worker]:
         while True:
-            # 根据资产属性选择一个工作机
-            worker: Optional[Worker] = await self.__select_worker(asset)
-            if not worker:
-                raise ValidationException({
-                    'worker': _('Not found a valid worker')
-                })
-            # 检查工作机是否可连接
-            connectivity: bool = await worker.test_connectivity()
+            # 根据资产属性选择一个工作机，候选工作机的槽位都被占满时等待释放，不等待时返回 None
+            async with self._slot_released:
+                while (load := await self.__select_worker(asset)) is None:
+                    if not await self.__candidate_groups(asset):
+                        raise ValidationException({
+                            'worker': _('Not found a valid worker')
+                        })
+                    if not wait:
+                        return None
+                    await self._slot_released.wait()
+            # 优先使用健康检查缓存的结果，缓存过期时才同步探测
+            worker: Worker = load.worker
+            health: WorkerHealth = self._health.setdefault(str(worker.id), WorkerHealth())
+            if health.fresh(settings.WORKER.HEALTH_CHECK_TTL):
+                connectivity: bool = health.healthy
+            else:
+                connectivity: bool = await self.__probe(worker)
             if not connectivity:
-                self._useless_workers[str(worker.id)] = worker
+                await self.__release(load)
+                await self.__mark_useless(worker)
             else:
-                self._running_workers[str(asset.id)] = worker
+                self._running_workers[key] = (load, time.monotonic())
                 break
         return worker
 
-    async def __pre_run(self, asset: Asset) -> Worker:
-        worker: Worker = await self.__get_valid_worker(asset)
+    async def __put_back(self, key: str) -> None:
+        if running := self._running_workers.pop(key, None):
+            load, start = running
+            await self.__release(load, time.monotonic() - start)
+
+    async def __reserve(self, task: TaskInstance) -> bool:
+        # 分发时非阻塞地预留工作机，没有候选工作机的错误交给 work 处理，任务照常标记失败
+        try:
+            worker = await self.__get_valid_worker(task.asset, str(task.id), wait=False)
+        except ValidationException:
+            return True
+        return worker is not None
+
+    async def __park(self, entry: tuple) -> None:
+        groups: list[WorkerScheduler] = await self.__candidate_groups(entry[2].asset)
+        tags: frozenset = frozenset(t for t, g in self._groups.items() if g in groups)
+        self._parked[entry[1]] = (entry, tags)
+
+    def __resume_parked(self, tag: Optional[str], limit: int) -> None:
+        # 把等待该标签的任务按原优先级放回队列，数量不超过空闲槽位，未能预留的任务会再次暂存
+        if not self._parked or self._queue is None:
+            return
+        parked: list = sorted(self._parked.values(), key=lambda p: p[0])
+        for entry, tags in parked:
+            if limit <= 0 or self._queue.full():
+                break
+            if tag in tags:
+                del self._parked[entry[1]]
+                self._queue.put_nowait(entry)
+                limit -= 1
+
+    async def __pre_run(self, task: TaskInstance) -> Worker:
+        # 分发时已预留工作机的任务直接使用预留结果
+        if running := self._running_workers.get(str(task.id)):
+            return running[0].worker
+        worker: Worker = await self.__get_valid_worker(task.asset, str(task.id))
         return worker
 
     @staticmethod
-    async def __run(task: TaskInstance) -> None:
-        await task.worker.run(task)
+    async def __publish(task_id: str, frame: dict) -> None:
+        # 执行输出逐帧交给输出中心，由其批量落库并推送给实时订阅者，同时合并后上报 Core
+        await TaskOutputHub().publish(task_id, frame)
+        if frame['type'] == TaskFrameType.output:
+            await StatusReporter().report_output(task_id, frame.get('data'))
+
+    @staticmethod
+    async def __report(state: TaskState | BatchTaskState, final: bool = False) -> None:
+        await StatusReporter().report(
+            str(state.id), state.model_dump(mode='json', exclude={'id'}), final
+        )
 
-    async def __post_run(self, asset: Asset) -> None:
-        worker: Worker = self._running_workers.pop(str(asset.id))
-        await self.add_worker(worker)
+    async def __run(self, task: TaskInstance) -> None:
+        exit_code: Optional[int] = None
+        async for frame in task.worker.stream(task):
+            if frame['type'] == TaskFrameType.task_end:
+                exit_code = frame.get('exit_code')
+            await self.__publish(str(task.id), frame)
+        if exit_code != 0:
+            raise RuntimeError(_('Task exited with code %s') % exit_code)
+
+    async def __post_run(self, task: TaskInstance) -> None:
+        await self.__put_back(str(task.id))
+
+    async def __mark_useless(self, worker: Worker) -> None:
+        if str(worker.id) not in self._useless_workers:
+            logger.warning(f'{worker} is unreachable, removed from the worker pool')
+        await self.remove_worker(worker)
+        self._useless_workers[str(worker.id)] = worker
+        await worker.close_agent()
+
+    async def __probe(self, worker: Worker) -> bool:
+        config = settings.WORKER
+        connectivity: bool = await worker.test_connectivity()
+        self._health.setdefault(str(worker.id), WorkerHealth()).record(
+            connectivity, config.HEALTH_CHECK_INTERVAL, config.HEALTH_CHECK_BACKOFF_MAX
+        )
+        if not connectivity:
+            await self.__mark_useless(worker)
+        elif self._useless_workers.pop(str(worker.id), None):
+            # 恢复连接的工作机重新加入调度
+            logger.info(f'{worker} is reachable again, re-admitted to the worker pool')
+            await self.add_worker(worker)
+        return connectivity
+
+    async def __health_check(self) -> None:
+        config = settings.WORKER
+        limit: asyncio.Semaphore = asyncio.Semaphore(config.HEALTH_CHECK_CONCURRENCY)
+
+        async def probe(w: Worker) -> None:
+            async with limit:
+                try:
+                    await self.__probe(w)
+                except Exception as error:
+                    logger.error(f'Health check of {w} failed: {error}')
+
+        while True:
+            now: float = time.monotonic()
+            due: list[Worker] = [
+                w for i, w in self._known_workers.items()
+                if self._health[i].next_check <= now
+            ]
+            if due:
+                await asyncio.gather(*(probe(w) for w in due))
+            # 休眠到下一个需要探测的时间点
+            next_check: float = min(
+                (h.next_check for h in self._health.values()),
+                default=time.monotonic() + config.HEALTH_CHECK_INTERVAL
+            )
+            await asyncio.sleep(min(
+                max(next_check - time.monotonic(), 1), config.HEALTH_CHECK_INTERVAL
+            ))
+
+    def stats(self) -> dict:
+        return {
+            'groups': {
+                tag or 'default': {
+                    load.worker.name: {
+                        'in_flight': load.in_flight, 'slots': load.slots,
+                        'latency': round(load.latency, 4)
+                    } for load in group.loads()
+                } for tag, group in self._groups.items()
+            },
+            'health': {
+                self._known_workers[i].name: h.to_dict() for i, h in self._health.items()
+            },
+            'useless': [w.name for w in self._useless_workers.values()],
+            'parked': len(self._parked),
+        }
 
     async def work(self, task: TaskInstance) -> None:
-        worker: Worker = await self.__pre_run(task.asset)
+        worker: Worker = await self.__pre_run(task)
         task.worker = worker
         try:
             await self.__run(task)
         except Exception as err:
             logger.error(f'{task.asset} work failed: {err}')
+            raise
+        finally:
+            await self.__post_run(task)
+
+    async def start(self) -> None:
+        self._queue = asyncio.PriorityQueue(maxsize=settings.WORKER.TASK_QUEUE_SIZE)
+        self._consumers = [
+            asyncio.create_task(self.__consume())
+            for __ in range(settings.WORKER.DISPATCH_CONCURRENCY)
+        ]
+        logger.info(f'Task dispatcher started with {len(self._consumers)} consumers')
+        if settings.WORKER.HEALTH_CHECK_INTERVAL > 0:
+            self._health_checker = asyncio.create_task(self.__health_check())
+
+    async def stop(self) -> None:
+        tasks: list[asyncio.Task] = [*self._consumers, *self._batch_jobs]
+        if self._health_checker is not None:
+            tasks = [*tasks, self._health_checker]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(w.close_agent() for w in self._known_workers.values()))
+        self._consumers = []
+        self._health_checker = None
+
+    async def __remember(self, state: TaskState) -> None:
+        self._states[str(state.id)] = state
+        while len(self._states) > settings.WORKER.TASK_STATE_RETENTION:
+            self._states.popitem(last=False)
+
+    async def submit(self, task: TaskInstance) -> TaskState:
+        if self._queue is None:
+            raise ValidationException({'task': _('Task dispatcher is not started')})
+        if self._queue.full():
+            raise ValidationException({'task': _('Task queue is full')})
+
+        state: TaskState = TaskState(id=task.id, priority=task.priority)
+        await self.__remember(state)
+        await self.__report(state)
+        await TaskOutputHub().open(str(task.id))
+        # PriorityQueue 优先取最小值，priority 越大越先执行，同优先级按提交顺序
+        self._queue.put_nowait((-task.priority, next(self._sequence), task))
+        return state
+
+    async def get_state(self, task_id: str) -> Optional[TaskState]:
+        return self._states.get(task_id)
+
+    async def __consume(self) -> None:
+        while True:
+            entry: tuple = await self._queue.get()
+            task: TaskInstance = entry[2]
+            if not await self.__reserve(task):
+                # 槽位占满时暂存任务，分发协程继续处理其他标签的任务，避免队头阻塞
+                await self.__park(entry)
+                self._queue.task_done()
+                continue
+            state: Optional[TaskState] = self._states.get(str(task.id))
+            if state is None:
+                state = TaskState(id=task.id, priority=task.priority)
+                await self.__remember(state)
+            state.status = TaskStatus.running
+            state.started_at = datetime.now()
+            await self.__report(state)
+            try:
+                await self.work(task)
+                state.status = TaskStatus.done
+            except Exception as error:
+                state.status = TaskStatus.failed
+                state.error = str(error)
+            finally:
+                state.worker_id = task.worker.id if task.worker else None
+                state.finished_at = datetime.now()
+                self._queue.task_done()
+                await TaskOutputHub().close(str(task.id))
+                await self.__report(state, final=True)
+
+    async def submit_batch(self, task: BatchTaskInstance) -> BatchTaskState:
+        if self._queue is None:
+            raise ValidationException({'task': _('Task dispatcher is not started')})
+        # 与单个任务的队列上限一致，执行中的批量任务达到上限时直接拒绝
+        if len(self._batch_jobs) >= settings.WORKER.BATCH_MAX_JOBS:
+            raise ValidationException({'task': _('Task queue is full')})
+
+        results: dict[str, BatchAssetResult] = {
+            str(i): BatchAssetResult(asset_id=i) for i in task.asset_ids
+        }
+        state: BatchTaskState = BatchTaskState(
+            id=task.id, total=len(results), queued=len(results)
+        )
+        self._batch_states[str(task.id)] = state
+        self._batch_results[str(task.id)] = results
+        while len(self._batch_states) > settings.WORKER.TASK_STATE_RETENTION:
+            task_id, __ = self._batch_states.popitem(last=False)
+            self._batch_results.pop(task_id, None)
+
+        await self.__report(state)
+        await TaskOutputHub().open(str(task.id))
+        job: asyncio.Task = asyncio.create_task(self.__run_batch(task, state, results))
+        self._batch_jobs.add(job)
+        job.add_done_callback(self._batch_jobs.discard)
+        return state
+
+    async def get_batch_state(self, task_id: str) -> Optional[BatchTaskState]:
+        return self._batch_states.get(task_id)
+
+    async def get_batch_results(
+            self, task_id: str, status: Optional[TaskStatus] = None
+    ) -> Optional[list[BatchAssetResult]]:
+        if (results := self._batch_results.get(task_id)) is None:
+            return None
+        return [r for r in results.values() if status is None or r.status == status]
+
+    async def __set_result(
+            self, state: BatchTaskState, result: BatchAssetResult, status: TaskStatus, **data
+    ) -> None:
+        # 计数字段与状态同名，状态变化时同步调整进度
+        setattr(state, result.status.value, getattr(state, result.status.value) - 1)
+        setattr(state, status.value, getattr(state, status.value) + 1)
+        result.status = status
+        for key, value in data.items():
+            setattr(result, key, value)
+        await self.__report(state)
+
+    async def __partition(
+            self, task: BatchTaskInstance, state: BatchTaskState,
+            results: dict[str, BatchAssetResult], assets: list[Asset]
+    ) -> list[list[Asset]]:
+        # 按候选工作机分组归并资产，每组再按组内工作机数量切分，一份资产子集对应一次脚本执行
+        buckets: dict[int, tuple[WorkerScheduler, list[Asset]]] = {}
+        for asset in assets:
+            if not (groups := await self.__candidate_groups(asset)):
+                await self.__set_result(
+                    state, results[str(asset.id)], TaskStatus.failed,
+                    error=_('Not found a valid worker')
+                )
+                continue
+            buckets.setdefault(id(groups[0]), (groups[0], []))[1].append(asset)
+
+        parts: list[list[Asset]] = []
+        for group, items in buckets.values():
+            count: int = max(min(len(group), len(items), task.fan_out), 1)
+            size: int = math.ceil(len(items) / count)
+            parts.extend(items[i:i + size] for i in range(0, len(items), size))
+        return parts
+
+    async def __run_part(
+            self, task: BatchTaskInstance, state: BatchTaskState,
+            results: dict[str, BatchAssetResult], part: list[Asset],
+            semaphore: asyncio.Semaphore, used: dict[str, Worker]
+    ) -> None:
+        async with semaphore:
+            key: str = f'{task.id}:{uuid.uuid4().hex}'
+            error: Optional[str] = None
+            try:
+                worker: Worker = await self.__get_valid_worker(part[0], key)
+            except ValidationException:
+                worker, error = None, _('Not found a valid worker')
+
+            if worker is not None:
+                used[str(worker.id)] = worker
+                for asset in part:
+                    await self.__set_result(
+                        state, results[str(asset.id)], TaskStatus.running, worker_id=worker.id
+                    )
+                targets: list[dict] = [
+                    {'id': str(a.id), 'name': a.name, 'address': a.address} for a in part
+                ]
+                try:
+                    async for frame in worker.stream(task, targets):
+                        if frame['type'] == TaskFrameType.target_end and \
+                                (result := results.get(str(frame.get('asset_id')))):
+                            status: TaskStatus = TaskStatus.done \
+                                if frame.get('exit_code') == 0 else TaskStatus.failed
+                            await self.__set_result(
+                                state, result, status, exit_code=frame.get('exit_code'),
+                                duration=frame.get('duration')
+                            )
+                        # 每份资产子集各自的开始/结束帧不转发，整个批量任务只在首尾各发一次
+                        if frame['type'] in (TaskFrameType.task_start, TaskFrameType.task_end):
+                            continue
+                        await self.__publish(str(task.id), frame)
+                except Exception as err:
+                    logger.error(f'Batch task {task.id} failed on {worker}: {err}')
+                    error = str(err)
+                finally:
+                    await self.__put_back(key)
+
+            # 脚本异常退出或没有可用工作机时，未上报结果的资产记为失败
+            for asset in part:
+                result: BatchAssetResult = results[str(asset.id)]
+                if result.status in (TaskStatus.queued, TaskStatus.running):
+                    await self.__set_result(
+                        state, result, TaskStatus.failed,
+                        error=error or _('No result reported')
+                    )
+
+    async def __run_batch(
+            self, task: BatchTaskInstance, state: BatchTaskState,
+            results: dict[str, BatchAssetResult]
+    ) -> None:
+        state.status = TaskStatus.running
+        state.started_at = datetime.now()
+        await self.__report(state)
+        await self.__publish(str(task.id), {'type': TaskFrameType.task_start})
+        used: dict[str, Worker] = {}
+        asset_ids: list[str] = list(results.keys())
+        try:
+            # 按批滚动执行，上一批全部结束后再加载并执行下一批，内存占用只与批大小相关
+            for offset in range(0, len(asset_ids), task.batch_size):
+                window: list[str] = asset_ids[offset:offset + task.batch_size]
+                assets: list[Asset] = await Asset.get_many(window)
+                for asset_id in set(window) - {str(a.id) for a in assets}:
+                    await self.__set_result(
+                        state, results[asset_id], TaskStatus.failed, error=_('Asset not found')
+                    )
+                parts: list[list[Asset]] = await self.__partition(task, state, results, assets)
+                semaphore: asyncio.Semaphore = asyncio.Semaphore(task.fan_out)
+                await asyncio.gather(*(
+                    self.__run_part(task, state, results, part, semaphore, used)
+                    for part in parts
+                ))
+                logger.info(
+                    f'Batch task {task.id} progress: '
+                    f'{state.done + state.failed}/{state.total}, failed {state.failed}'
+                )
+            state.status = TaskStatus.done if state.failed == 0 else TaskStatus.failed
+        except Exception as error:
+            logger.error(f'Batch task {task.id} aborted: {error}')
+            state.status = TaskStatus.failed
+            state.error = str(error)
+            for result in results.values():
+                if result.status in (TaskStatus.queued, TaskStatus.running):
+                    await self.__set_result(state, result, TaskStatus.failed, error=str(error))
         finally:
-            await self.__post_run(task.asset)
+            state.finished_at = datetime.now()
+            # 清理各工作机上只上传过一次的命令文件
+            await asyncio.gather(*(w.clear(task) for w in used.values()), return_exceptions=True)
+            await self.__publish(str(task.id), {
+                'type': TaskFrameType.task_end,
+                'exit_code': 0 if state.status == TaskStatus.done else 1,
+                'duration': round((state.finished_at - state.started_at).total_seconds(), 3)
+            })
+            await TaskOutputHub().close(str(task.id))
+            await self.__report(state, final=True)
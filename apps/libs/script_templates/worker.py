@@ -1,18 +1,72 @@
 import argparse
 import asyncio
+import base64
 import os
 import json
+import signal
+import sys
+import time
 
-from typing import Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 from argparse import Namespace
 
 from Crypto.Cipher import AES  # noqa
 from Crypto.Util.Padding import pad, unpad # noqa
 
 
+class StepStatus(object):
+    done = 'done'
+    failed = 'failed'
+    timeout = 'timeout'
+    cancelled = 'cancelled'
+    skipped = 'skipped'
+
+
+class Step(object):
+    def __init__(
+            self, index: int, step_id: str, command: str,
+            depends: List[str], timeout: Optional[float], target: Optional[dict] = None
+    ) -> None:
+        self.index = index
+        self.id = step_id
+        self.command = command
+        self.depends = depends
+        self.timeout = timeout
+        self.target = target
+        self.status: Optional[str] = None
+        self.output_size = 0
+
+    def frame(self, **data) -> dict:
+        # 批量任务中每个步骤都带上所属资产，便于服务端按资产汇总
+        if self.target is not None:
+            data['asset_id'] = self.target['id']
+        return {'index': self.index, 'step': self.id, **data}
+
+    def env(self) -> Optional[dict]:
+        if self.target is None:
+            return None
+        return {
+            **os.environ,
+            'BEHEMOTH_ASSET_ID': str(self.target['id']),
+            'BEHEMOTH_ASSET_NAME': str(self.target.get('name', '')),
+            'BEHEMOTH_ASSET_ADDRESS': str(self.target.get('address', '')),
+        }
+
+
 class WorkerScript(object):
-    def __init__(self) -> None:
+    # 单行输出超过该长度时拆分为多帧，读取缓冲区大小固定
+    max_line_size: int = 8192
+    # 超时或取消时先 SIGTERM，等待该时间后仍未退出则 SIGKILL
+    kill_grace: float = 3
+
+    def __init__(self, tag: Optional[dict] = None) -> None:
+        # 常驻模式下每帧带上运行标识，服务端据此把输出分发给对应的任务
+        self._tag: dict = tag or {}
         self._commands: list = []
+        self._parallelism: int = 1
+        self._timeout: Optional[float] = None
+        self._max_output: int = 1024 * 1024
+        self._targets: Optional[List[dict]] = None
         self._token: Optional[str] = None
         self._worker_id: Optional[str] = None
         self._task_id: Optional[str] = None
@@ -35,9 +89,17 @@ class WorkerScript(object):
         parser.add_argument(
             '-k', '--encryption_key', help='Key used to decrypt command collection file'
         )
+        parser.add_argument(
+            '-a', '--targets', action='store_true',
+            help='Read the target assets of a batch task from stdin as JSON'
+        )
+        parser.add_argument(
+            '--agent', action='store_true',
+            help='Stay resident and read task envelopes from stdin line by line'
+        )
 
         args: Namespace = parser.parse_args()
-        if args.credential:
+        if not args.credential:
             raise Exception('Credential cannot be empty [credential]')
         if not os.path.exists(args.commands_path):
             raise Exception('Command collection file does not exist [commands_path]')
@@ -53,27 +115,295 @@ class WorkerScript(object):
         self._encryption_key = args.encryption_key
         self._worker_id = args.worker_id
         self._task_id = args.task_id
+        if args.targets:
+            self._targets = json.loads(sys.stdin.read())
 
         await self.__decrypt_commands()
 
+    async def _process_envelope(self, envelope: dict) -> None:
+        for field in ('credential', 'worker_id', 'task_id', 'encryption_key', 'commands'):
+            if not envelope.get(field):
+                raise Exception(f'Envelope field cannot be empty [{field}]')
+
+        self._token = envelope['credential']
+        self._encryption_key = envelope['encryption_key']
+        self._worker_id = envelope['worker_id']
+        self._task_id = envelope['task_id']
+        self._targets = envelope.get('targets')
+        self._load_commands(base64.b64decode(envelope['commands']))
+
     async def __decrypt_commands(self) -> None:
-        with open(self._commands_path, 'wb') as file:
-            ciphertext = file.read()
+        with open(self._commands_path, 'rb') as file:
+            self._load_commands(file.read())
+
+    def _load_commands(self, ciphertext: bytes) -> None:
         iv = ciphertext[:AES.block_size]
-        cipher = AES.new(self._encryption_key, AES.MODE_CBC, iv)
+        cipher = AES.new(self._encryption_key.encode(), AES.MODE_CBC, iv)
         plaintext = unpad(cipher.decrypt(ciphertext[AES.block_size:]), AES.block_size)
-        self._commands = json.loads(plaintext.decode())['commands']
+        data = json.loads(plaintext.decode())
+        self._commands = data['commands']
+        self._parallelism = max(int(data.get('parallelism') or 1), 1)
+        self._timeout = data.get('timeout') or None
+        self._max_output = data.get('max_output') or self._max_output
+
+    def _build_steps(self, target: Optional[dict] = None) -> List[Step]:
+        # 命令可以是字符串，也可以是 {id, command, depends, timeout} 形式的步骤
+        steps: List[Step] = []
+        for index, item in enumerate(self._commands):
+            if isinstance(item, str):
+                item = {'command': item}
+            # 与全局配置一致，步骤的 timeout 为 0 或空时表示不限制
+            timeout: Optional[float] = item.get('timeout', self._timeout) or None
+            steps.append(Step(
+                index, str(item.get('id', index)), item['command'],
+                [str(d) for d in item.get('depends', [])], timeout, target
+            ))
+
+        ids: Set[str] = {s.id for s in steps}
+        if len(ids) != len(steps):
+            raise Exception('Duplicate step id in command collection')
+        for step in steps:
+            if unknown := set(step.depends) - ids:
+                raise Exception(f'Step {step.id} depends on unknown steps: {sorted(unknown)}')
 
-    async def _run(self):
-        pass
+        # 拓扑排序检查依赖是否成环
+        waiting: Dict[str, int] = {s.id: len(set(s.depends)) for s in steps}
+        dependents: Dict[str, List[str]] = {s.id: [] for s in steps}
+        for step in steps:
+            for depend in set(step.depends):
+                dependents[depend].append(step.id)
+        ready: List[str] = [i for i, count in waiting.items() if count == 0]
+        visited = 0
+        while ready:
+            visited += 1
+            for child in dependents[ready.pop()]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    ready.append(child)
+        if visited != len(steps):
+            raise Exception('Circular dependency in command collection')
+        return steps
+
+    def _emit(self, frame_type: str, **data) -> None:
+        # 每帧一行 JSON，立即刷新，服务端逐行读取
+        sys.stdout.write(json.dumps({'type': frame_type, **self._tag, **data}) + '\n')
+        sys.stdout.flush()
+
+    def _emit_output(self, step: Step, name: str, line: bytes) -> None:
+        # 单个命令的输出超过上限后只继续读取丢弃，避免远端进程因管道写满而阻塞
+        if step.output_size >= self._max_output:
+            return
+        step.output_size += len(line)
+        self._emit('output', **step.frame(stream=name, data=line.decode(errors='replace')))
+        if step.output_size >= self._max_output:
+            self._emit('output', **step.frame(
+                stream=name, data=f'[output truncated at {self._max_output} bytes]'
+            ))
+
+    async def _read_stream(self, step: Step, name: str, stream: asyncio.StreamReader) -> None:
+        buffer = b''
+        while chunk := await stream.read(self.max_line_size):
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                self._emit_output(step, name, line)
+            while len(buffer) >= self.max_line_size:
+                self._emit_output(step, name, buffer[:self.max_line_size])
+                buffer = buffer[self.max_line_size:]
+        if buffer:
+            self._emit_output(step, name, buffer)
+
+    async def _communicate(self, step: Step, process: asyncio.subprocess.Process) -> int:
+        await asyncio.gather(
+            self._read_stream(step, 'stdout', process.stdout),
+            self._read_stream(step, 'stderr', process.stderr),
+        )
+        return await process.wait()
 
-    async def run(self):
+    async def _kill(self, process: asyncio.subprocess.Process) -> None:
+        # 命令在独立的进程组中运行，连同其子进程一起结束
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(process.wait(), self.kill_grace)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    async def _run_step(self, step: Step, semaphore: asyncio.Semaphore) -> Step:
+        async with semaphore:
+            self._emit('command_start', **step.frame(command=step.command))
+            start = time.monotonic()
+            exit_code: Optional[int] = None
+            process = await asyncio.create_subprocess_shell(
+                step.command, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE, start_new_session=True, env=step.env()
+            )
+            try:
+                exit_code = await asyncio.wait_for(
+                    self._communicate(step, process), step.timeout
+                )
+                step.status = StepStatus.done if exit_code == 0 else StepStatus.failed
+            except asyncio.TimeoutError:
+                step.status = StepStatus.timeout
+                await self._kill(process)
+            except asyncio.CancelledError:
+                step.status = StepStatus.cancelled
+                await self._kill(process)
+                raise
+            finally:
+                self._emit('command_end', **step.frame(
+                    status=step.status,
+                    exit_code=exit_code if exit_code is not None else process.returncode,
+                    duration=round(time.monotonic() - start, 3)
+                ))
+        return step
+
+    def _skip(self, step: Step, steps: Dict[str, Step], dependents: Dict[str, List[str]]) -> None:
+        # 依赖失败的步骤及其所有下游步骤都不再执行
+        if step.status is not None:
+            return
+        step.status = StepStatus.skipped
+        self._emit('command_end', **step.frame(status=step.status, exit_code=None, duration=0))
+        for child in dependents[step.id]:
+            self._skip(steps[child], steps, dependents)
+
+    async def _run_target(self, target: Optional[dict], semaphore: asyncio.Semaphore) -> int:
+        start = time.monotonic()
+        steps: Dict[str, Step] = {s.id: s for s in self._build_steps(target)}
+        waiting: Dict[str, Set[str]] = {i: set(s.depends) for i, s in steps.items()}
+        dependents: Dict[str, List[str]] = {i: [] for i in steps}
+        for step in steps.values():
+            for depend in waiting[step.id]:
+                dependents[depend].append(step.id)
+
+        ready: List[Step] = [s for s in steps.values() if not waiting[s.id]]
+        running: Set[asyncio.Future] = set()
         try:
-            await self._process_cmd_line_args()
-            await self._run()
+            while ready or running:
+                # 无依赖的步骤按声明顺序提交，并发数由信号量限制
+                running.update(asyncio.ensure_future(self._run_step(s, semaphore)) for s in ready)
+                ready = []
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    finished: Step = task.result()
+                    for child in dependents[finished.id]:
+                        if finished.status != StepStatus.done:
+                            self._skip(steps[child], steps, dependents)
+                            continue
+                        waiting[child].discard(finished.id)
+                        if not waiting[child] and steps[child].status is None:
+                            ready.append(steps[child])
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
+
+        exit_code = 0 if all(s.status == StepStatus.done for s in steps.values()) else 1
+        if target is not None:
+            self._emit(
+                'target_end', asset_id=target['id'], exit_code=exit_code,
+                duration=round(time.monotonic() - start, 3)
+            )
+        return exit_code
+
+    async def _run(self) -> int:
+        # 所有目标资产共用一个信号量，工作机上同时执行的命令总数受 parallelism 限制
+        semaphore = asyncio.Semaphore(self._parallelism)
+        if self._targets is None:
+            return await self._run_target(None, semaphore)
+        exit_codes = await asyncio.gather(
+            *(self._run_target(t, semaphore) for t in self._targets)
+        )
+        return 0 if all(c == 0 for c in exit_codes) else 1
+
+    async def execute(self, prepare: Callable[[], Awaitable[None]]) -> int:
+        start = time.monotonic()
+        self._emit('task_start')
+        try:
+            await prepare()
+            exit_code = await self._run()
+        except asyncio.CancelledError:
+            self._emit('error', data='Task cancelled')
+            exit_code = 130
         except Exception as error:
-            print(f'Failed to execute script: {error}')
+            self._emit('error', data=f'Failed to execute script: {error}')
+            exit_code = 1
+        self._emit('task_end', exit_code=exit_code, duration=round(time.monotonic() - start, 3))
+        return exit_code
+
+    async def run(self) -> int:
+        # 收到终止信号(包括 SSH 会话断开)时取消全部正在执行的命令
+        main_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            loop.add_signal_handler(sig, main_task.cancel)
+        return await self.execute(self._process_cmd_line_args)
+
+
+class WorkerAgent(object):
+    # 常驻模式：进程只启动一次，任务信封逐行从标准输入读取，多个任务并发执行
+    # 信封格式 {"type": "run", "id": ..., "credential": ..., "worker_id": ...,
+    #          "task_id": ..., "encryption_key": ..., "commands": base64(密文), "targets": [...]}
+    # 取消任务 {"type": "cancel", "id": ...}，标准输入关闭后取消全部任务并退出
+    max_envelope_size: int = 64 * 1024 * 1024
+
+    def __init__(self) -> None:
+        self._runs: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _emit(frame_type: str, **data) -> None:
+        sys.stdout.write(json.dumps({'type': frame_type, **data}) + '\n')
+        sys.stdout.flush()
+
+    def _dispatch(self, line: bytes) -> None:
+        try:
+            envelope = json.loads(line)
+            run_id = str(envelope['id'])
+        except (ValueError, TypeError, KeyError) as error:
+            self._emit('agent_error', data=f'Invalid envelope: {error}')
+            return
+
+        if envelope.get('type') == 'cancel':
+            if task := self._runs.get(run_id):
+                task.cancel()
+        elif run_id in self._runs:
+            self._emit('agent_error', run=run_id, data='Duplicate run id')
+        else:
+            script = WorkerScript(tag={'run': run_id})
+            task = asyncio.ensure_future(script.execute(lambda: script._process_envelope(envelope)))
+            task.add_done_callback(lambda __: self._runs.pop(run_id, None))
+            self._runs[run_id] = task
+
+    async def run(self) -> int:
+        main_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            loop.add_signal_handler(sig, main_task.cancel)
+        reader = asyncio.StreamReader(limit=self.max_envelope_size)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        self._emit('agent_ready', pid=os.getpid())
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    self._dispatch(line)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # 退出前取消未完成的任务，每个任务仍会回传 task_end
+            runs = list(self._runs.values())
+            for task in runs:
+                task.cancel()
+            if runs:
+                await asyncio.wait(runs)
+        return 0
 
 
 if __name__ == '__main__':
-    asyncio.run(WorkerScript().run())
+    script = WorkerAgent() if '--agent' in sys.argv[1:] else WorkerScript()
+    sys.exit(asyncio.run(script.run()))
@@ -1,9 +1,11 @@
+import asyncio
 import importlib
 import inspect
 
 import uvicorn
 
-from typing import Callable
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
 from gettext import gettext as _
 
 from fastapi import FastAPI
@@ -13,18 +15,38 @@ from apps.middlewares import TokenMiddleware
 from settings import settings
 from assets.routers import router as assets_router
 from common.exceptions import register_exceptions
-from common.init import check_jms, check_db, apps_init
+from common.init import startup
+from common.stats import log_stats
+from libs.db import ESClient
+from libs.jms.client import jms_client
+from libs.jms.reporter import StatusReporter
+from libs.pools import SSHConnectionPool
+from libs.pools.worker import WorkerPool
 
 
-async def startup():
-    await check_jms()
-    await check_db()
-    await apps_init()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ESClient().start()
+    stats_logger: Optional[asyncio.Task] = None
+    try:
+        await startup()
+        await StatusReporter().start()
+        if settings.APP.STATS_LOG_INTERVAL > 0:
+            stats_logger = asyncio.create_task(log_stats())
+        yield
+    finally:
+        if stats_logger is not None:
+            stats_logger.cancel()
+        await WorkerPool().stop()
+        await StatusReporter().stop()
+        await SSHConnectionPool().close()
+        await jms_client.close()
+        await ESClient().close()
 
 
 app = FastAPI(
     title='Behemoth', summary=_('Command managed management component'),
-    on_startup=[startup],
+    lifespan=lifespan,
     # middleware=[Middleware(TokenMiddleware)]
 )
 
@@ -6,6 +6,7 @@ from pydantic import BaseModel
 
 from .db import ElasticSearch
 from .app import App
+from .worker import Worker
 
 
 class Settings(BaseModel):
@@ -14,6 +15,7 @@ class Settings(BaseModel):
     DATA_DIR: str = os.path.join(PROJECT_DIR, 'data')
     ES: ElasticSearch
     APP: App
+    WORKER: Worker = Worker()
 
     @classmethod
     def from_yml(cls):
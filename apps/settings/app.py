@@ -10,6 +10,20 @@ class App(BaseModel):
     DEBUG: bool = False
     RELOAD: bool = False
     LOG_LEVEL: str = 'error'
+    STATS_LOG_INTERVAL: float = 300
     CORE_HOST: str = 'http://jms_core'
+    CORE_MAX_CONNECTIONS: int = 10
+    CORE_KEEPALIVE_TIMEOUT: float = 60
+    CORE_CONNECT_TIMEOUT: float = 5
+    CORE_REQUEST_TIMEOUT: float = 15
+    CORE_MAX_RETRIES: int = 3
+    CORE_RETRY_BACKOFF: float = 0.5
+    CORE_RETRY_BACKOFF_MAX: float = 10
+    CORE_REPORT_ENABLED: bool = False
+    CORE_REPORT_BATCH_SIZE: int = 200
+    CORE_REPORT_FLUSH_INTERVAL: float = 2
+    CORE_REPORT_MAX_PENDING: int = 10000
+    CORE_REPORT_MAX_OUTPUT: int = 8388608
+    CORE_REPORT_SPOOL_MAX_SIZE: int = 104857600
     BOOTSTRAP_TOKEN: str
     SECRET_KEY: str
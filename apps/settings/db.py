@@ -3,3 +3,20 @@ from pydantic import BaseModel
 
 class ElasticSearch(BaseModel):
     HOSTS: str
+    CONNECTIONS_PER_NODE: int = 10
+    REQUEST_TIMEOUT: float = 10
+    MAX_RETRIES: int = 3
+    RETRY_ON_TIMEOUT: bool = True
+    HTTP_COMPRESS: bool = False
+    NODE_SELECTOR: str = 'round_robin'
+    SNIFF_ON_START: bool = False
+    BULK_CHUNK_SIZE: int = 500
+    BULK_CONCURRENCY: int = 4
+    PIT_KEEP_ALIVE: str = '1m'
+    SCAN_BATCH_SIZE: int = 500
+    CACHE_ENABLED: bool = True
+    CACHE_TTL: int = 30
+    CACHE_MAX_SIZE: int = 1024
+    INDEX_REFRESH_INTERVAL: float = 1
+    REINDEX_POLL_INTERVAL: float = 1
+    MAX_RESULT_WINDOW: int = 10000
@@ -0,0 +1,32 @@
+from pydantic import BaseModel
+
+
+class Worker(BaseModel):
+    SSH_MAX_CONNECTIONS: int = 2
+    SSH_MAX_CHANNELS: int = 8
+    SSH_IDLE_TIMEOUT: float = 300
+    SSH_CONNECT_TIMEOUT: float = 10
+    SSH_KEEPALIVE_INTERVAL: float = 30
+    SSH_KEEPALIVE_COUNT_MAX: int = 3
+    DISPATCH_CONCURRENCY: int = 8
+    TASK_QUEUE_SIZE: int = 10000
+    MAX_TASKS_PER_WORKER: int = 1
+    SCHEDULING_STRATEGY: str = 'least_in_flight'
+    TASK_STATE_RETENTION: int = 10000
+    HEALTH_CHECK_INTERVAL: float = 30
+    HEALTH_CHECK_TTL: float = 90
+    HEALTH_CHECK_CONCURRENCY: int = 16
+    HEALTH_CHECK_BACKOFF_MAX: float = 600
+    HEALTH_CHECK_TIMEOUT: float = 10
+    OUTPUT_BATCH_SIZE: int = 200
+    OUTPUT_FLUSH_INTERVAL: float = 1
+    OUTPUT_SUBSCRIBER_QUEUE: int = 1000
+    SCRIPT_PARALLELISM: int = 4
+    SCRIPT_COMMAND_TIMEOUT: float = 0
+    SCRIPT_MAX_OUTPUT: int = 1048576
+    BATCH_FAN_OUT: int = 16
+    BATCH_SIZE: int = 500
+    BATCH_MAX_JOBS: int = 16
+    AGENT_MODE: bool = False
+    AGENT_IDLE_TIMEOUT: float = 600
+    AGENT_RETRY_INTERVAL: float = 300
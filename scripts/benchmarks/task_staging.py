@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import asyncssh
+
+
+APP_DIR: str = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'apps'
+)
+# 本地代理在每个方向上注入的单程延迟(秒)，往返一次即 2 * LATENCY
+LATENCY: float = 0.02
+TASKS: int = 10
+
+
+class BenchServer(asyncssh.SSHServer):
+    def begin_auth(self, username: str) -> bool:
+        return False
+
+
+async def handle_process(process: asyncssh.SSHServerProcess) -> None:
+    proc = await asyncio.create_subprocess_shell(
+        process.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    process.stdout.write(stdout.decode())
+    process.stderr.write(stderr.decode())
+    process.exit(proc.returncode)
+
+
+async def pump(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # 数据按到达顺序延迟转发，模拟网络时延
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def deliver() -> None:
+        while (item := await queue.get()) is not None:
+            deadline, data = item
+            await asyncio.sleep(max(deadline - time.monotonic(), 0))
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    task: asyncio.Task = asyncio.create_task(deliver())
+    while data := await reader.read(65536):
+        queue.put_nowait((time.monotonic() + LATENCY, data))
+    queue.put_nowait(None)
+    await task
+
+
+async def start_proxy(target_port: int) -> asyncio.Server:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', target_port)
+        try:
+            await asyncio.gather(
+                pump(reader, upstream_writer), pump(upstream_reader, writer),
+                return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            # 基准结束时事件循环会取消仍在转发的连接
+            pass
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def calc_md5(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.md5(file.read()).hexdigest()
+
+
+async def stage_with_scp(
+        conn: asyncssh.SSHClientConnection, root: str, script: str, payload: bytes
+) -> None:
+    # 改造前: md5sum 校验脚本 + mkdir + scp 命令文件 + rm 清理，均为独立的远端命令
+    # 旧实现已从代码中移除，这里按原步骤重建，仅作为对比基线
+    remote_script: str = os.path.join(root, 'scp', 'script', 'worker.py')
+    result = await conn.run(f'md5sum {remote_script}')
+    if result.returncode != 0 or result.stdout.split()[0] != calc_md5(script):
+        await conn.run(f'mkdir -p {os.path.dirname(remote_script)}')
+        await asyncssh.scp(script, (conn, remote_script))
+
+    local_file: str = os.path.join(root, 'local', f'{uuid.uuid4().hex}.json')
+    remote_file: str = os.path.join(root, 'scp', 'commands', os.path.basename(local_file))
+    os.makedirs(os.path.dirname(local_file), exist_ok=True)
+    with open(local_file, 'wb') as file:
+        file.write(payload)
+    await conn.run(f'mkdir -p {os.path.dirname(remote_file)}')
+    await asyncssh.scp(local_file, (conn, remote_file))
+
+    await conn.run(f'rm -f {remote_file}')
+    os.remove(local_file)
+
+
+def load_worker() -> tuple:
+    # 引入应用模块，需要项目根目录下存在 config.yml
+    sys.path[:0] = [os.path.dirname(APP_DIR), APP_DIR]
+    from assets.models import Account, Asset, Worker
+    from assets.serializers import TaskInstance
+    from common.utils import random_string
+    from libs.pools.ssh import SSHConnectionPool
+    return Account, Asset, Worker, TaskInstance, random_string, SSHConnectionPool
+
+
+async def stage_with_worker(worker, task, pool) -> None:
+    # 改造后: 直接调用 Worker 一次性执行前后的实际步骤，即脚本部署、命令文件写入与清理
+    async with worker.connect() as conn:
+        sftp: asyncssh.SFTPClient = await pool.sftp(conn)
+        await worker._Worker__process_file(sftp, task)
+        await worker._Worker__clear(sftp, task)
+
+
+async def measure(name: str, func, runs: int) -> None:
+    costs: list[float] = []
+    for __ in range(runs):
+        start: float = time.perf_counter()
+        await func()
+        costs.append(time.perf_counter() - start)
+    first, steady = costs[0], sum(costs[1:]) / max(len(costs) - 1, 1)
+    rtt: float = 2 * LATENCY
+    print(f'{name:<16} first {first * 1000:>8.1f}ms ({first / rtt:>5.1f} RTT)  '
+          f'steady {steady * 1000:>8.1f}ms ({steady / rtt:>5.1f} RTT)')
+
+
+async def main() -> None:
+    root: str = tempfile.mkdtemp(prefix='behemoth-bench-')
+    script: str = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'apps', 'libs', 'script_templates', 'worker.py'
+    )
+    payload: bytes = os.urandom(2048)
+    server = await asyncssh.create_server(
+        BenchServer, '127.0.0.1', 0,
+        server_host_keys=[asyncssh.generate_private_key('ssh-ed25519')],
+        process_factory=handle_process, sftp_factory=True, allow_scp=True
+    )
+    proxy: asyncio.Server = await start_proxy(server.sockets[0].getsockname()[1])
+    port: int = proxy.sockets[0].getsockname()[1]
+    Account, Asset, Worker, TaskInstance, random_string, SSHConnectionPool = load_worker()
+    pool = SSHConnectionPool()
+    worker = Worker(
+        id=uuid.uuid4(), name='bench', address='127.0.0.1',
+        protocols=[{'name': 'ssh', 'port': port}]
+    )
+    worker.account = Account(name='bench', username='bench', password='', asset_id=worker.id)
+    asset = Asset(id=uuid.uuid4(), name='bench-target', address='127.0.0.1', protocols=[])
+    # 远端即本机，先删除已部署的脚本，保证首次执行是冷启动
+    script_dir: str = os.path.dirname(worker._script.remote_file)
+    shutil.rmtree(script_dir, ignore_errors=True)
+    try:
+        async with asyncssh.connect(
+                '127.0.0.1', port, username='bench', known_hosts=None
+        ) as conn:
+            print(f'one-way latency {LATENCY * 1000:.0f}ms, RTT {LATENCY * 2000:.0f}ms, '
+                  f'{TASKS} tasks (first = cold remote, steady = average of the rest)')
+            await measure('scp + run', lambda: stage_with_scp(conn, root, script, payload), TASKS)
+
+        # 连接池建立连接与打开 SFTP 会话只发生一次，单独计时
+        start: float = time.perf_counter()
+        async with worker.connect() as conn:
+            await pool.sftp(conn)
+        cost: float = time.perf_counter() - start
+        print(f'{"pool + sftp":<16} once  {cost * 1000:>8.1f}ms '
+              f'({cost / (2 * LATENCY):>5.1f} RTT) per connection')
+        await measure(
+            'worker staging',
+            lambda: stage_with_worker(
+                worker, TaskInstance(asset=asset, encryption_key=random_string(length=32, upper=False)), pool
+            ), TASKS
+        )
+    finally:
+        await pool.close()
+        proxy.close()
+        server.close()
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(script_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
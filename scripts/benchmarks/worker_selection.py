@@ -0,0 +1,75 @@
+import importlib.util
+import os
+import random
+import string
+import sys
+import time
+
+from difflib import SequenceMatcher
+from typing import Optional
+
+
+APP_DIR: str = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'apps'
+)
+
+
+def load_tag_index() -> type:
+    # 直接加载模块文件，避免引入 libs.pools 包时读取配置文件
+    path: str = os.path.join(APP_DIR, 'libs', 'pools', 'selector.py')
+    spec = importlib.util.spec_from_file_location('selector', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.TagIndex
+
+
+def random_tag() -> str:
+    region: str = random.choice(['bj', 'sh', 'gz', 'hk', 'sg', 'us', 'eu'])
+    env: str = random.choice(['prod', 'test', 'dev'])
+    suffix: str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+    return f'{region}-{env}-{suffix}'
+
+
+def sequence_matcher_select(tags: list[str], asset_tag: str) -> Optional[str]:
+    # 原 WorkerPool.__select_worker 的扫描方式
+    best_tag, minimum_ratio = None, 0
+    for tag in tags:
+        ratio: float = SequenceMatcher(None, asset_tag, tag).ratio()
+        if ratio <= minimum_ratio:
+            continue
+        minimum_ratio, best_tag = ratio, tag
+    return best_tag
+
+
+def bench(name: str, func, lookups: list[str]) -> float:
+    start: float = time.perf_counter()
+    for asset_tag in lookups:
+        func(asset_tag)
+    cost: float = time.perf_counter() - start
+    print(f'{name:<24} {len(lookups):>6} lookups  {cost:>9.4f}s  '
+          f'{cost / len(lookups) * 1e6:>12.1f}us/lookup')
+    return cost
+
+
+def main(tag_count: int = 10000, lookup_count: int = 50) -> None:
+    random.seed(0)
+    tags: list[str] = [random_tag() for __ in range(tag_count)]
+    # 一半精确命中，一半是带噪声的标签，且资产标签会重复出现
+    asset_tags: list[str] = random.sample(tags, 20) + [
+        t[:-2] + 'zz' for t in random.sample(tags, 20)
+    ]
+    lookups: list[str] = [random.choice(asset_tags) for __ in range(lookup_count)]
+
+    index = load_tag_index()()
+    build_start: float = time.perf_counter()
+    for tag in tags:
+        index.add(tag)
+    print(f'TagIndex build: {tag_count} tags in {time.perf_counter() - build_start:.4f}s')
+
+    legacy: float = bench('SequenceMatcher scan', lambda t: sequence_matcher_select(tags, t), lookups)
+    indexed: float = bench('TagIndex', index.match, lookups)
+    print(f'Speedup: {legacy / indexed:.0f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])